@@ -0,0 +1,257 @@
+# 用来测试入库各阶段的速度
+# 生成与真实存档格式相同的合成存档（yyyymmdd文件夹、3行表头、Dx/Ax分段、每行 序号 tag 数据 质量码），
+# 分阶段计时：逐行解析的parse_raw_file和向量化的parse_raw_file_bulk、进程池中的process_file_batch、
+# 按月合并merge_month以及生成汇总/统计等派生文件，报告每秒文件数、MB/s、各阶段耗时和各工作进程的内存峰值，
+# 结果可以保存为JSON，用--compare与以前保存的结果逐项比较，检查不同版本之间的性能回退
+#
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from get_raw_data_ver3 import (parse_raw_file, parse_raw_file_bulk, process_file_batch, merge_month,
+                               write_month_outputs, build_matrix_schema, narrowest_quality_type, float64_value_tags,
+                               plan_file_chunks, VALUE_TYPE, CHUNK_BYTES, FLOAT32_TOLERANCE)
+try:
+    import resource  # Windows下没有，内存峰值记为None
+except ImportError:
+    resource = None
+
+def generate_raw_files(folder, num_files, num_tags=1314, start_time=None, interval=15, seed=0):
+    """在folder中生成num_files个合成raw文件，返回文件路径列表"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    if start_time is None:
+        start_time = datetime.strptime(os.path.basename(os.path.normpath(folder)), '%Y%m%d')
+
+    # 前一半为数字量(Dx)，后一半为模拟量(Ax)
+    num_digital = num_tags // 2
+    prefixes = ['RC', 'PC', 'DDS', 'RPN', 'KIT', 'TEP']
+    tag_names = [f"{prefixes[i % len(prefixes)]}-{i:04d}-{'DI' if i < num_digital else 'AVT'}"
+                 for i in range(num_tags)]
+
+    file_paths = []
+    for k in range(num_files):
+        timestamp = start_time + timedelta(seconds=interval * k)
+        file_path = os.path.join(folder, f"SNAP_{timestamp.strftime('%Y%m%d%H%M%S')}.raw")
+        lines = ["RAW SNAPSHOT", timestamp.strftime('%Y-%m-%d %H:%M:%S'), "NO TAG VALUE QUALITY", "Dx"]
+        for i, tag in enumerate(tag_names):
+            if i == num_digital:
+                lines.append("Ax")
+            value = rng.randint(0, 1) if i < num_digital else round(rng.uniform(-50, 300), 3)
+            quality = 0 if rng.random() > 0.01 else 192
+            lines.append(f"{i + 1} {tag} {value} {quality}")
+        with open(file_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        file_paths.append(file_path)
+    return file_paths
+
+def generate_raw_tree(root, num_days, files_per_day, num_tags=1314, first_day='20240101', interval=15, seed=0):
+    """在root下生成num_days个连续的yyyymmdd文件夹，每个文件夹files_per_day个raw文件，返回全部文件路径"""
+    file_paths = []
+    day = datetime.strptime(first_day, '%Y%m%d')
+    for k in range(num_days):
+        folder = os.path.join(root, (day + timedelta(days=k)).strftime('%Y%m%d'))
+        file_paths.extend(generate_raw_files(folder, files_per_day, num_tags, interval=interval, seed=seed + k))
+    return file_paths
+
+def peak_rss_bytes():
+    """当前进程的内存峰值(字节)，没有resource模块时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Linux下单位为KB，macOS下为字节
+
+def timed_file_batch(args):
+    """在工作进程中执行process_file_batch，返回 (进程号, 耗时, 文件数, 进程内存峰值)"""
+    start = time.perf_counter()
+    process_file_batch(args)
+    return os.getpid(), time.perf_counter() - start, len(args[0]), peak_rss_bytes()
+
+def stage_result(seconds, num_files=None, num_bytes=None, **extra):
+    """一个阶段的结果：耗时和每秒文件数、MB/s"""
+    result = {'seconds': seconds}
+    if num_files is not None:
+        result['files_per_sec'] = num_files / seconds
+    if num_bytes is not None:
+        result['mb_per_sec'] = num_bytes / seconds / (1024 * 1024)
+    result.update(extra)
+    return result
+
+def benchmark_parsers(file_paths, repeat=3):
+    """对每种解析方式取repeat次中最快的一次，返回 {名称: 阶段结果}"""
+    def run_generator():
+        for file_path in file_paths:
+            for _ in parse_raw_file(file_path):
+                pass
+
+    def run_bulk():
+        for file_path in file_paths:
+            parse_raw_file_bulk(file_path)
+
+    num_bytes = sum(os.path.getsize(path) for path in file_paths)
+    results = {}
+    for name, func in [('parse_raw_file', run_generator), ('parse_raw_file_bulk', run_bulk)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        results[name] = stage_result(best, len(file_paths), num_bytes)
+    return results
+
+def benchmark_batches(file_paths, tag_names, num_workers, chunk_bytes):
+    """和fetch_data一样用plan_file_chunks按日期分成小任务块，由进程池逐块分发执行process_file_batch
+    （在当前目录的temp_parquet下写临时文件），返回阶段结果，
+    其中workers为各工作进程处理的批次数、文件数、累计耗时和内存峰值"""
+    os.makedirs('temp_parquet', exist_ok=True)
+    file_sizes = {path: os.path.getsize(path) for path in file_paths}
+    batches = [(files, batch_id, tag_names, FLOAT32_TOLERANCE)
+               for batch_id, (files, _) in enumerate(plan_file_chunks(file_paths, file_sizes, chunk_bytes))]
+    workers = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(timed_file_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            pid, seconds, num_files, peak = future.result()
+            worker = workers.setdefault(str(pid), {'batches': 0, 'files': 0, 'busy_seconds': 0.0, 'peak_rss_mb': None})
+            worker['batches'] += 1
+            worker['files'] += num_files
+            worker['busy_seconds'] += seconds
+            if peak is not None:
+                worker['peak_rss_mb'] = max(worker['peak_rss_mb'] or 0, peak / (1024 * 1024))
+    elapsed = time.perf_counter() - start
+    return stage_result(elapsed, len(file_paths), sum(file_sizes.values()), num_workers=num_workers,
+                        chunk_mb=chunk_bytes / (1024 * 1024), num_batches=len(batches), workers=workers)
+
+def benchmark_merge(output_dir, tag_names, value_type=VALUE_TYPE):
+    """按月合并temp_parquet中的临时文件（与fetch_data相同的分组和优先级），再生成派生文件，
+    返回 (合并阶段结果, 派生文件阶段结果)"""
+    monthly_sources = {}
+    for temp_file in sorted(os.listdir('temp_parquet')):
+        batch_id, month_key = temp_file[len('temp_batch_'):-len('.parquet')].split('_')
+        monthly_sources.setdefault(month_key, []).append((int(batch_id), os.path.join('temp_parquet', temp_file)))
+    
+    merge_seconds = derive_seconds = 0.0
+    num_rows = input_bytes = output_bytes = 0
+    for month_key, sources in sorted(monthly_sources.items()):
+        source_paths = [path for _, path in sorted(sources)]
+        input_bytes += sum(os.path.getsize(path) for path in source_paths)
+        output_file = os.path.join(output_dir, f'data_matrix_{month_key}.parquet')
+        start = time.perf_counter()
+        schema = build_matrix_schema(tag_names, value_type, narrowest_quality_type(source_paths),
+                                     float64_value_tags(source_paths))
+        num_rows += merge_month(source_paths, output_file, schema)
+        merge_seconds += time.perf_counter() - start
+        output_bytes += os.path.getsize(output_file)
+        
+        start = time.perf_counter()
+        write_month_outputs(output_file, month_key, output_dir)
+        derive_seconds += time.perf_counter() - start
+    
+    merge = stage_result(merge_seconds, num_bytes=input_bytes, months=len(monthly_sources), rows=num_rows,
+                         rows_per_sec=num_rows / merge_seconds if merge_seconds else None,
+                         output_mb=output_bytes / (1024 * 1024))
+    return merge, stage_result(derive_seconds, rows_per_sec=num_rows / derive_seconds if derive_seconds else None)
+
+def run_benchmark(args):
+    """生成合成存档并依次测试各阶段，返回可以保存为JSON的结果"""
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'pyarrow': pa.__version__},
+        'config': vars(args).copy(),
+        'stages': {},
+    }
+    results['config'].pop('output', None)
+    results['config'].pop('compare', None)
+    
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_root:
+        print(f"正在生成 {args.days} 天 × {args.files_per_day} 个合成raw文件，每个 {args.tags} 个tag...")
+        start = time.perf_counter()
+        file_paths = generate_raw_tree(os.path.join(temp_root, 'archive'), args.days, args.files_per_day, args.tags,
+                                       interval=args.interval)
+        num_bytes = sum(os.path.getsize(path) for path in file_paths)
+        results['dataset'] = {'files': len(file_paths), 'mb': num_bytes / (1024 * 1024), 'tags': args.tags,
+                              'days': args.days, 'generate_seconds': time.perf_counter() - start}
+        
+        # process_file_batch把临时文件写到当前目录的temp_parquet下
+        os.chdir(temp_root)
+        try:
+            print(f"解析: 取前 {min(args.parse_files, len(file_paths))} 个文件，重复 {args.repeat} 次取最快")
+            results['stages'].update(benchmark_parsers(file_paths[:args.parse_files], args.repeat))
+            
+            tag_names = parse_raw_file_bulk(file_paths[0])[1]
+            print(f"批处理: {args.workers} 个进程，每个任务块不超过 {args.chunk_mb:g}MB")
+            results['stages']['process_file_batch'] = benchmark_batches(file_paths, tag_names, args.workers,
+                                                                         int(args.chunk_mb * 1024 * 1024))
+            
+            print("合并: 按月归并临时文件并生成派生文件")
+            merge, derived = benchmark_merge(temp_root, tag_names)
+            results['stages']['merge_month'] = merge
+            results['stages']['write_month_outputs'] = derived
+        finally:
+            os.chdir(cwd)
+    
+    peak = peak_rss_bytes()
+    results['main_peak_rss_mb'] = peak / (1024 * 1024) if peak is not None else None
+    return results
+
+def print_results(results, baseline=None):
+    """打印各阶段结果，有baseline时附上与它相比的耗时比例"""
+    dataset = results['dataset']
+    print(f"\n数据: {dataset['files']} 个文件，{dataset['mb']:.1f} MB，{dataset['tags']} 个tag，{dataset['days']} 天")
+    def column(value, width, fmt):
+        return f"{value:>{width}{fmt}}" if value is not None else f"{'-':>{width}}"
+    
+    print(f"{'阶段':<22}{'耗时s':>9}{'文件/秒':>10}{'MB/s':>9}{'行/秒':>11}")
+    for name, stage in results['stages'].items():
+        line = (f"{name:<22}{stage['seconds']:>9.2f}{column(stage.get('files_per_sec'), 10, '.1f')}"
+                f"{column(stage.get('mb_per_sec'), 9, '.1f')}{column(stage.get('rows_per_sec'), 11, '.0f')}")
+        old = (baseline or {}).get('stages', {}).get(name)
+        if old:
+            line += f"  (耗时为基准的 {stage['seconds'] / old['seconds']:.0%})"
+        print(line)
+    
+    for pid, worker in results['stages']['process_file_batch']['workers'].items():
+        peak = f"{worker['peak_rss_mb']:.0f} MB" if worker['peak_rss_mb'] is not None else "未知"
+        print(f"  进程 {pid}: {worker['batches']} 批，{worker['files']} 个文件，"
+              f"忙碌 {worker['busy_seconds']:.2f}s，内存峰值 {peak}")
+    if results['main_peak_rss_mb'] is not None:
+        print(f"  主进程(解析、合并)内存峰值 {results['main_peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分阶段测试入库速度：解析、批处理、按月合并和派生文件")
+    parser.add_argument('--days', type=int, default=3, help="合成存档的天数(文件夹数)")
+    parser.add_argument('--files-per-day', type=int, default=1000, help="每天的raw文件数量")
+    parser.add_argument('--tags', type=int, default=1314, help="每个文件的tag数量")
+    parser.add_argument('--interval', type=int, default=15, help="相邻raw文件的时间间隔(秒)")
+    parser.add_argument('--parse-files', type=int, default=500, help="解析阶段使用的文件数量")
+    parser.add_argument('--repeat', type=int, default=3, help="解析阶段每种方式重复次数")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="批处理阶段的进程数")
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / (1024 * 1024),
+                        help="批处理阶段每个任务块的raw文件总大小上限(MB)")
+    parser.add_argument('--output', help="把结果保存为JSON文件")
+    parser.add_argument('--compare', help="与以前保存的JSON结果比较")
+    args = parser.parse_args()
+    
+    results = run_benchmark(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
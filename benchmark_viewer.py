@@ -0,0 +1,266 @@
+# 用来测试数据查看器的响应速度
+# 在临时目录中生成合成的月度数据文件(data_matrix_YYYYMM.parquet，结构与入库程序生成的相同，
+# 同时生成汇总、统计文件和tag目录)，用offscreen平台在没有显示器的环境中启动DataViewer，
+# 分别计时启动加载、填充tag树、搜索框逐字输入、不同时间范围和tag数量的绘图、创建范围输入框和右键点击，
+# 报告每项的p50/p95延迟，结果可以保存为JSON，用--compare与以前保存的结果比较
+#
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from get_raw_data_ver3 import (build_matrix_schema, write_month_outputs, load_tag_catalog, write_json,
+                               ROW_GROUP_ROWS, TAG_CATALOG_FILE)
+
+# 绘图测试的时间范围
+PLOT_WINDOWS = [('1h', pd.Timedelta(hours=1)), ('1d', pd.Timedelta(days=1)), ('1w', pd.Timedelta(weeks=1)),
+                ('1M', pd.Timedelta(days=30)), ('3M', pd.Timedelta(days=90))]
+
+def generate_month_files(folder, num_months, num_tags=1314, interval=60, first_month='202401',
+                         derived=True, seed=0):
+    """在folder中生成num_months个合成月度文件，数值为随机游走，约1%的质量码异常；
+    derived为True时和入库程序一样生成汇总、统计文件和tag目录。返回tag列表"""
+    rng = np.random.default_rng(seed)
+    prefixes = ['RC', 'PC', 'DDS', 'RPN', 'KIT', 'TEP']
+    num_digital = num_tags // 2
+    tag_names = [f"{prefixes[i % len(prefixes)]}-{i:04d}-{'DI' if i < num_digital else 'AVT'}"
+                 for i in range(num_tags)]
+    schema = build_matrix_schema(tag_names, 'float32', pa.uint8())
+
+    level = rng.uniform(-50, 300, num_tags)
+    for month in pd.period_range(pd.Period(first_month, freq='M'), periods=num_months, freq='M'):
+        month_key = month.strftime('%Y%m')
+        times = pd.date_range(month.start_time, month.end_time, freq=f'{interval}s').values
+        output_file = os.path.join(folder, f'data_matrix_{month_key}.parquet')
+        with pq.ParquetWriter(output_file, schema, write_statistics=['timestamp']) as writer:
+            for start in range(0, len(times), ROW_GROUP_ROWS):
+                chunk_times = times[start:start + ROW_GROUP_ROWS]
+                steps = rng.normal(0, 0.5, (len(chunk_times), num_tags))
+                values = level + np.cumsum(steps, axis=0)
+                level = values[-1].copy()
+                values[:, :num_digital] = np.floor(values[:, :num_digital]) % 2
+                qualities = np.where(rng.random((len(chunk_times), num_tags)) < 0.01, 192, 0).astype(np.uint8)
+                arrays = []
+                for i in range(num_tags):
+                    arrays.append(pa.array(values[:, i].astype(np.float32)))
+                    arrays.append(pa.array(qualities[:, i]))
+                arrays.append(pa.array(chunk_times))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=ROW_GROUP_ROWS)
+        if derived:
+            write_month_outputs(output_file, month_key, folder)
+    if derived:
+        write_json(load_tag_catalog(folder), os.path.join(folder, TAG_CATALOG_FILE))
+    return tag_names
+
+def percentiles(samples):
+    """{'n', 'p50', 'p95', 'max'}，单位毫秒"""
+    samples_ms = np.asarray(samples) * 1000
+    return {'n': len(samples_ms), 'p50': float(np.percentile(samples_ms, 50)),
+            'p95': float(np.percentile(samples_ms, 95)), 'max': float(samples_ms.max())}
+
+class ViewerBenchmark:
+    """在当前目录的数据上启动DataViewer并逐项计时"""
+    def __init__(self, app, viewer, seed=0):
+        self.app = app
+        self.viewer = viewer
+        self.rng = np.random.default_rng(seed)
+
+    def wait_idle(self, kinds=('plot', 'ranges', 'prefetch')):
+        """处理事件直到后台加载请求全部完成"""
+        while any(self.viewer.loader.is_busy(kind) for kind in kinds):
+            self.app.processEvents()
+            time.sleep(0.001)
+        self.app.processEvents()
+
+    def time_calls(self, func, repeat, setup=None):
+        samples = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    def bench_load_initial_data(self, repeat):
+        return self.time_calls(self.viewer.load_initial_data, repeat)
+
+    def bench_populate_tag_tree(self, repeat):
+        return self.time_calls(self.viewer.populate_tag_tree, repeat, setup=self.viewer.tag_model.clear)
+
+    def bench_filter_tags(self, queries):
+        """逐字输入每个查询（每次按键都执行一次过滤，相当于没有防抖时的最坏情况），最后清空搜索框"""
+        samples = []
+        for query in queries:
+            for i in range(1, len(query) + 1):
+                start = time.perf_counter()
+                self.viewer.filter_tags(query[:i])
+                samples.append(time.perf_counter() - start)
+            self.viewer.filter_tags('')
+        return samples
+
+    def select(self, tags):
+        self.viewer.selected_tag_set.clear()
+        self.viewer.select_tags(tags)
+        self.wait_idle()
+
+    def set_window(self, start_time, end_time):
+        from PyQt6.QtCore import QDateTime
+        self.viewer.start_time_edit.setDateTime(QDateTime(start_time.to_pydatetime()))
+        self.viewer.end_time_edit.setDateTime(QDateTime(end_time.to_pydatetime()))
+
+    def plot_once(self):
+        """从调用update_plot到后台加载完成、画布重画结束的时间；预读不计入"""
+        start = time.perf_counter()
+        self.viewer.update_plot()
+        self.wait_idle(('plot',))
+        elapsed = time.perf_counter() - start
+        self.wait_idle()
+        return elapsed
+
+    def bench_update_plot(self, num_tags, window, repeat, data_start, data_end):
+        """在随机位置的时间范围上绘制num_tags个tag，返回 (冷启动样本, 已缓存样本)
+        冷启动前重新调用load_initial_data，丢弃缓存和已读取的文件元数据（操作系统的文件缓存不受影响）；
+        已缓存样本紧接着以同样的范围重画一次，只包含取数、抽稀和绘图"""
+        cold, warm = [], []
+        tags = [str(tag) for tag in self.rng.choice(self.viewer.tags, num_tags, replace=False)]
+        span = (data_end - data_start) - window
+        for _ in range(repeat):
+            offset = pd.Timedelta(seconds=int(self.rng.integers(0, max(int(span.total_seconds()), 0) + 1)))
+            start_time = (data_start + offset).floor('s')
+            self.viewer.load_initial_data()
+            self.select(tags)
+            self.set_window(start_time, start_time + window)
+            cold.append(self.plot_once())
+            self.viewer.drawn_request = None
+            warm.append(self.plot_once())
+        return cold, warm
+
+    def bench_range_controls(self, num_tags, repeat):
+        tags = self.viewer.get_selected_tags()[:num_tags]
+        def setup():
+            self.wait_idle()
+            self.viewer.create_range_controls([])
+        samples = self.time_calls(lambda: self.viewer.create_range_controls(tags), repeat, setup)
+        self.wait_idle()
+        return samples
+
+    def bench_mouse_click(self, repeat):
+        """在绘图区内随机位置右键点击，计时标注所有曲线上最近的点并重画覆盖层"""
+        from matplotlib.backend_bases import MouseEvent
+        ax = self.viewer.plot_axes[0][0]
+        x0, y0, width, height = ax.bbox.bounds
+        samples = []
+        for _ in range(repeat):
+            x = x0 + width * self.rng.uniform(0.05, 0.95)
+            y = y0 + height * self.rng.uniform(0.05, 0.95)
+            event = MouseEvent('button_press_event', self.viewer.canvas, x, y, button=3)
+            start = time.perf_counter()
+            self.viewer.canvas.callbacks.process('button_press_event', event)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+def run_benchmark(args):
+    """生成合成数据并依次测试各项，返回可以保存为JSON的结果"""
+    from PyQt6.QtWidgets import QApplication
+    import matplotlib
+    results = {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'pyarrow': pa.__version__,
+                     'matplotlib': matplotlib.__version__},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'latency_ms': {},
+    }
+    latency = results['latency_ms']
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_root:
+        print(f"正在生成 {args.months} 个月的合成数据，{args.tags} 个tag，间隔 {args.interval} 秒...")
+        start = time.perf_counter()
+        generate_month_files(temp_root, args.months, args.tags, args.interval, derived=not args.raw_only)
+        data_mb = sum(os.path.getsize(os.path.join(temp_root, f)) for f in os.listdir(temp_root)
+                      if f.startswith('data_matrix_')) / (1024 * 1024)
+        results['dataset'] = {'months': args.months, 'tags': args.tags, 'data_mb': data_mb,
+                              'generate_seconds': time.perf_counter() - start}
+
+        # 查看器从当前目录读取数据
+        os.chdir(temp_root)
+        try:
+            from data_viewer_ver13 import DataViewer
+            app = QApplication.instance() or QApplication(sys.argv[:1])
+            viewer = DataViewer()
+            viewer.resize(1600, 1000)
+            viewer.show()
+            app.processEvents()
+            bench = ViewerBenchmark(app, viewer, args.seed)
+
+            print("计时: 启动加载、tag树、搜索")
+            latency['load_initial_data'] = percentiles(bench.bench_load_initial_data(args.repeat))
+            latency['populate_tag_tree'] = percentiles(bench.bench_populate_tag_tree(args.repeat))
+            latency['filter_tags'] = percentiles(bench.bench_filter_tags(args.queries))
+
+            data_start = pd.Timestamp(f'{viewer.store.months[0]}01')
+            data_end = viewer.store.get_time_bounds(viewer.store.months[-1])[1]
+            for num_tags in args.plot_tags:
+                for name, window in PLOT_WINDOWS:
+                    if window > data_end - data_start:
+                        continue
+                    print(f"计时: {num_tags} 个tag、{name} 范围的绘图")
+                    cold, warm = bench.bench_update_plot(num_tags, window, args.repeat, data_start, data_end)
+                    latency[f'update_plot[{num_tags} tags, {name}, cold]'] = percentiles(cold)
+                    latency[f'update_plot[{num_tags} tags, {name}, cached]'] = percentiles(warm)
+                latency[f'create_range_controls[{num_tags} tags]'] = percentiles(
+                    bench.bench_range_controls(num_tags, args.repeat))
+                latency[f'on_mouse_click[{num_tags} tags]'] = percentiles(bench.bench_mouse_click(args.repeat * 5))
+
+            viewer.close()
+        finally:
+            os.chdir(cwd)
+    return results
+
+def print_results(results, baseline=None):
+    """打印各项的p50/p95，有baseline时附上与它相比的p50比例"""
+    dataset = results['dataset']
+    print(f"\n数据: {dataset['months']} 个月，{dataset['tags']} 个tag，原始数据 {dataset['data_mb']:.1f} MB")
+    print(f"{'项目':<42}{'次数':>6}{'p50 ms':>10}{'p95 ms':>10}{'最大 ms':>10}")
+    old_latency = (baseline or {}).get('latency_ms', {})
+    for name, stat in results['latency_ms'].items():
+        line = f"{name:<42}{stat['n']:>6}{stat['p50']:>10.1f}{stat['p95']:>10.1f}{stat['max']:>10.1f}"
+        old = old_latency.get(name)
+        if old:
+            line += f"  (p50为基准的 {stat['p50'] / old['p50']:.0%})"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在没有显示器的环境中测试数据查看器各项操作的延迟")
+    parser.add_argument('--months', type=int, default=3, help="合成数据的月数")
+    parser.add_argument('--tags', type=int, default=1314, help="tag数量")
+    parser.add_argument('--interval', type=int, default=60, help="合成数据的采样间隔(秒)")
+    parser.add_argument('--raw-only', action='store_true', help="只生成原始数据，不生成汇总、统计文件和tag目录")
+    parser.add_argument('--plot-tags', type=int, nargs='+', default=[1, 4, 8], help="绘图测试的tag数量")
+    parser.add_argument('--queries', nargs='+', default=['DDS-01', 'kit*avt', '0?2'], help="搜索测试逐字输入的文本")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数")
+    parser.add_argument('--seed', type=int, default=0, help="随机选择tag和时间范围的种子")
+    parser.add_argument('--output', help="把结果保存为JSON文件")
+    parser.add_argument('--compare', help="与以前保存的JSON结果比较")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
@@ -1,12 +1,24 @@
 # 用来展示数据
 import sys
 import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                            QHBoxLayout, QLabel, QPushButton, QTreeWidget,
-                            QDateTimeEdit, QCheckBox, QTreeWidgetItem,
-                            QTreeWidgetItemIterator, QLineEdit, QFrame)
-from PyQt6.QtCore import Qt, QDateTime, QTimer
+                            QHBoxLayout, QLabel, QPushButton, QTreeView,
+                            QDateTimeEdit, QCheckBox, QLineEdit, QFrame, QProgressBar,
+                            QComboBox, QAbstractItemView, QMessageBox)
+from PyQt6.QtCore import (Qt, QDateTime, QTimer, QObject, pyqtSignal,
+                          QSortFilterProxyModel, QItemSelection, QItemSelectionModel)
+from PyQt6.QtGui import QStandardItemModel, QStandardItem
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
@@ -14,6 +26,8 @@ from matplotlib.gridspec import GridSpec
 import numpy as np
 from datetime import datetime
 import logging
+from logging.handlers import RotatingFileHandler
+from get_raw_data_ver3 import ROLLUP_LEVELS, read_matrix_layout
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
 plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
 plt.style.use('dark_background')
@@ -23,8 +37,750 @@ plt.rcParams.update({
     'savefig.facecolor': '#2b2b2b',
 })
 
+def decimate_minmax(times, values, num_buckets, start_time=None, end_time=None):
+    """按像素把时间轴分桶，每桶只保留最小值点和最大值点，返回要绘制的点的下标
+
+    尖峰一定落在某个桶的最小或最大值上，所以抽稀后不会丢失；每桶最多2个点，
+    绘制的点数只与画布宽度有关，与时间范围内的原始点数无关。NaN不参与绘制。
+    """
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) <= 2 * num_buckets:
+        return valid
+    t = times[valid].astype('datetime64[ns]').view(np.int64)
+    v = values[valid]
+    t0 = t[0] if start_time is None else np.datetime64(pd.Timestamp(start_time), 'ns').view(np.int64)
+    t1 = t[-1] if end_time is None else np.datetime64(pd.Timestamp(end_time), 'ns').view(np.int64)
+    
+    # 每个非空桶的起始下标
+    edges = np.linspace(t0, t1, num_buckets + 1)[1:-1]
+    starts = np.unique(np.r_[0, np.searchsorted(t, edges, side='left')])
+    starts = starts[starts < len(t)]
+    counts = np.diff(np.r_[starts, len(t)])
+    
+    # 每桶的最小/最大值，再找出桶内第一个等于最小/最大值的位置
+    positions = np.arange(len(t))
+    bucket_min = np.repeat(np.minimum.reduceat(v, starts), counts)
+    bucket_max = np.repeat(np.maximum.reduceat(v, starts), counts)
+    min_idx = np.minimum.reduceat(np.where(v == bucket_min, positions, len(t)), starts)
+    max_idx = np.minimum.reduceat(np.where(v == bucket_max, positions, len(t)), starts)
+    
+    keep = np.unique(np.r_[0, min_idx, max_idx, len(t) - 1])
+    return valid[keep]
+
+def nearest_sample(index_ns, t_ns):
+    """在有序的int64纳秒时间索引中二分查找离t_ns最近的点，返回下标，索引为空时返回-1"""
+    n = len(index_ns)
+    if n == 0:
+        return -1
+    i = int(np.searchsorted(index_ns, t_ns))
+    if i == 0:
+        return 0
+    if i == n:
+        return n - 1
+    return i if index_ns[i] - t_ns < t_ns - index_ns[i - 1] else i - 1
+
+CURSOR_TOLERANCE_SECONDS = 20  # 游标与数据点的最大时间差，抽稀后一个像素更宽时按像素宽度
+ZOOM_STEP = 1.25  # 滚轮每格的缩放倍数
+MIN_WINDOW_SECONDS = 60  # 缩放到的最小时间范围
+NAVIGATE_DELAY_MS = 150  # 缩放、平移停下多久后加载可见范围的数据
+
+def column_to_numpy(column):
+    """把读出的列转换为numpy数组，保持存储时的窄类型（float32、uint8等）
+
+    可空的质量码列中缺失的值按0读入：缺失的质量码对应的数值是NaN，不会被绘出，
+    这样不需要为了表示空值把整列转换成float64
+    """
+    if column.null_count and pa.types.is_integer(column.type):
+        column = column.fill_null(0)
+    return column.to_numpy(zero_copy_only=False)
+
+class LoadCancelled(Exception):
+    """后台加载请求已被更新的请求取代"""
+
+class DataLoader(QObject):
+    """在后台线程中加载数据，界面线程不会因为读取文件而卡住
+
+    每个请求属于一个类别(如'plot'、'ranges')，同一类别只保留最新的请求：
+    旧请求在两次读取之间发现自己过期后停止，完成后也不再回调。
+    回调通过Qt信号回到界面线程执行；最新的请求出错时不调用回调，改为发出failed信号。
+    """
+    progress = pyqtSignal(str, int, int)  # 请求类别, 已完成, 总数
+    finished = pyqtSignal(str, int, object)  # 请求类别, 请求编号, 出错时的异常
+    failed = pyqtSignal(str, object)  # 请求类别, 异常
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._latest = {}
+        self._callbacks = {}
+        self.finished.connect(self._on_finished)
+    
+    def submit(self, kind, load_func, callback):
+        """提交请求：load_func(progress, cancelled)在后台线程执行，成功后在界面线程调用callback()"""
+        request_id = self._latest.get(kind, 0) + 1
+        self._latest[kind] = request_id
+        self._callbacks[(kind, request_id)] = callback
+        
+        def cancelled():
+            return self._latest.get(kind) != request_id
+        
+        def progress(done, total):
+            if not cancelled():
+                self.progress.emit(kind, done, total)
+        
+        def run():
+            error = None
+            try:
+                if cancelled():
+                    raise LoadCancelled()
+                load_func(progress, cancelled)
+            except Exception as e:
+                error = e
+            self.finished.emit(kind, request_id, error)
+        
+        self._executor.submit(run)
+        return request_id
+    
+    def is_busy(self, kind):
+        return any(key[0] == kind for key in self._callbacks)
+    
+    def cancel(self, kind):
+        """取消某一类别尚未完成的请求"""
+        if kind in self._latest:
+            self._latest[kind] += 1
+        for key in [key for key in self._callbacks if key[0] == kind]:
+            del self._callbacks[key]
+    
+    def _on_finished(self, kind, request_id, error):
+        callback = self._callbacks.pop((kind, request_id), None)
+        if self._latest.get(kind) != request_id or isinstance(error, LoadCancelled):
+            return
+        if error is not None:
+            logging.error(f"加载数据出错: {str(error)}")
+            self.failed.emit(kind, error)
+        elif callback is not None:
+            callback()
+    
+    def shutdown(self):
+        """取消所有请求，不等待正在读取的文件"""
+        for kind in self._latest:
+            self._latest[kind] += 1
+        self._callbacks.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+ROLLUP_PLOT_TYPES = ('min', 'max', 'last', 'bad')
+
+CACHE_BUDGET_MB = 1024  # 数据缓存的默认内存预算
+
+class ChunkCache:
+    """按字节预算做LRU淘汰的数据块缓存，原始数据和各汇总层级共用
+
+    每个数据块是单独的numpy数组(一个row group的时间索引，或一个row group中某个tag的一列)，
+    拼接显示范围时只切片和连接需要的块，不会复制或重新排序其他已缓存的数据。
+    hits/misses统计加载请求需要的数据块中已缓存和需要读取的个数。
+    """
+    def __init__(self, budget_bytes=CACHE_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.lock = threading.RLock()
+        self._chunks = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pinned = {}  # 持有者 -> 固定的键集合
+    
+    def __contains__(self, key):
+        return key in self._chunks
+    
+    def get(self, key):
+        """取出数据块并标记为最近使用，不存在时返回None"""
+        with self.lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks.move_to_end(key)
+            return chunk
+    
+    def missing(self, keys):
+        """返回keys中尚未缓存的键，同时计入命中和未命中次数"""
+        with self.lock:
+            missing = [key for key in keys if key not in self._chunks]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            return missing
+    
+    def put(self, key, chunk):
+        with self.lock:
+            old = self._chunks.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old.nbytes
+            self._chunks[key] = chunk
+            self.size_bytes += chunk.nbytes
+    
+    def touch(self, keys):
+        """把一批数据块标记为最近使用"""
+        with self.lock:
+            for key in keys:
+                if key in self._chunks:
+                    self._chunks.move_to_end(key)
+    
+    def pin(self, owner, keys):
+        """固定一批数据块，在unpin(owner)之前不会被淘汰（例如已加载完、还没有绘出的数据）"""
+        with self.lock:
+            self._pinned.setdefault(owner, set()).update(keys)
+    
+    def unpin(self, owner):
+        with self.lock:
+            self._pinned.pop(owner, None)
+    
+    def trim(self, protected=()):
+        """按最久未使用的顺序淘汰，直到不超过预算；protected中的块（当前请求正在用的）和固定的块不淘汰"""
+        with self.lock:
+            protected = set(protected).union(*self._pinned.values())
+            for key in list(self._chunks):
+                if self.size_bytes <= self.budget_bytes:
+                    break
+                if key in protected:
+                    continue
+                self.size_bytes -= self._chunks.pop(key).nbytes
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class DataStore:
+    """按月数据文件的按列、按row group延迟加载
+
+    prefix为'data_matrix_'时读取原始数据(data_matrix_YYYYMM.parquet)，
+    为'rollup_1h_'等时读取入库时生成的汇总数据，两者结构相同：(tag, type)两层列索引，
+    原始数据的type为value/quality，汇总数据为min/max/mean/last/count/bad。
+    启动时只读取文件的schema得到tag列表；绘图时只读取选中tag需要的列。月度文件按时间排序、
+    分成多个row group，并带有timestamp列的min/max统计，据此只读取与时间范围重叠的row group。
+    时间索引按 (月份, row group) 缓存、各tag共用，数据按 (月份, row group, tag, type) 缓存，
+    都放在共用的ChunkCache中按内存预算淘汰。
+    入库时按tag前缀分区的文件(by_prefix/data_<前缀>_YYYYMM.parquet)结构相同，用prefix='data_RC_'等读取。
+    """
+    def __init__(self, data_dir='.', prefix='data_matrix_', cache=None):
+        self.data_dir = data_dir
+        self.prefix = prefix
+        self.cache = cache if cache is not None else ChunkCache()
+        self.month_files = {}
+        for f in sorted(os.listdir(data_dir)):
+            month = f[len(prefix):-len('.parquet')]
+            if f.startswith(prefix) and f.endswith('.parquet') and len(month) == 6 and month.isdigit():
+                self.month_files[month] = os.path.join(data_dir, f)
+        self._layouts = {}  # month -> (索引列名, {tag: {type: 列名}})
+        self._metadata = {}  # month -> parquet文件尾部的元数据
+        self._row_groups = {}  # month -> (每个row group的最小时间, 最大时间, 是否都有统计信息)
+        self.tag_count = None  # 每个文件中tag数量的估计(来自tag目录)，用来估算还没打开过的文件的读取量
+    
+    @property
+    def months(self):
+        return list(self.month_files)
+    
+    def get_layout(self, month):
+        """只读取schema，解析出索引列名和每个tag各类型对应的列名"""
+        if month not in self._layouts:
+            index_column, columns = read_matrix_layout(self._open(month))
+            self._layouts[month] = (index_column or '__index_level_0__', columns)
+        return self._layouts[month]
+    
+    def get_tags(self, month):
+        """某个月文件中的全部tag"""
+        return list(self.get_layout(month)[1])
+    
+    def _open(self, month):
+        """打开月度文件，复用已解析的文件尾部元数据；用完即关，不妨碍入库程序替换文件"""
+        if month not in self._metadata:
+            self._metadata[month] = pq.read_metadata(self.month_files[month])
+        return pq.ParquetFile(self.month_files[month], metadata=self._metadata[month])
+    
+    def get_row_groups(self, month):
+        """各row group的时间范围，来自timestamp列的min/max统计；没有统计信息的row group视为覆盖全部时间"""
+        if month not in self._row_groups:
+            index_column, _ = self.get_layout(month)
+            metadata = self._open(month).metadata
+            col_idx = metadata.schema.names.index(index_column)
+            mins = np.full(metadata.num_row_groups, np.iinfo(np.int64).min, dtype=np.int64)
+            maxs = np.full(metadata.num_row_groups, np.iinfo(np.int64).max, dtype=np.int64)
+            complete = True
+            for rg in range(metadata.num_row_groups):
+                stats = metadata.row_group(rg).column(col_idx).statistics
+                if stats is not None and stats.has_min_max:
+                    mins[rg] = pd.Timestamp(stats.min).value
+                    maxs[rg] = pd.Timestamp(stats.max).value
+                else:
+                    complete = False
+            self._row_groups[month] = (mins.view('datetime64[ns]'), maxs.view('datetime64[ns]'), complete)
+        return self._row_groups[month]
+    
+    def get_time_bounds(self, month):
+        """月文件的起止时间，优先用row group的统计信息，不读取数据"""
+        mins, maxs, complete = self.get_row_groups(month)
+        if complete and len(mins):
+            return pd.Timestamp(mins.min()), pd.Timestamp(maxs.max())
+        index_column, _ = self.get_layout(month)
+        times = pq.read_table(self.month_files[month], columns=[index_column]).column(0).to_numpy()
+        return pd.Timestamp(times.min()), pd.Timestamp(times.max())
+    
+    def months_between(self, start_time, end_time):
+        """时间范围内存在数据文件的月份"""
+        months = pd.period_range(pd.Timestamp(start_time), pd.Timestamp(end_time), freq='M')
+        return [m.strftime('%Y%m') for m in months if m.strftime('%Y%m') in self.month_files]
+    
+    def row_groups_between(self, month, start_time, end_time):
+        """与[start_time, end_time]重叠的row group"""
+        mins, maxs, _ = self.get_row_groups(month)
+        start = np.datetime64(pd.Timestamp(start_time), 'ns')
+        end = np.datetime64(pd.Timestamp(end_time), 'ns')
+        return np.flatnonzero((mins <= end) & (maxs >= start)).tolist()
+    
+    def estimate_read_bytes(self, tags, start_time, end_time, types=('value', 'quality')):
+        """估计load这些tag在时间范围内的数据还需要从磁盘读取多少字节，不读取数据
+
+        已经打开过的月份按文件尾部元数据中各列块的压缩大小累加，已缓存的块不计；
+        还没打开过的月份要先读取文件尾部的元数据（长度记在文件最后8个字节中），
+        数据部分按需要的列数占全部列数的比例、时间范围占整月的比例估算
+        """
+        start, end = pd.Timestamp(start_time), pd.Timestamp(end_time)
+        total = 0
+        for month in self.months_between(start_time, end_time):
+            if month in self._metadata:
+                index_column, tag_columns = self.get_layout(month)
+                metadata = self._metadata[month]
+                col_indices = {name: i for i, name in enumerate(metadata.schema.names)}
+                wanted = [(tag, col_type) for tag in tags for col_type in types if col_type in tag_columns.get(tag, {})]
+                with self.cache.lock:
+                    for rg in self.row_groups_between(month, start_time, end_time):
+                        rg_meta = metadata.row_group(rg)
+                        missing = [key for key in wanted if self._column_key(month, rg, *key) not in self.cache]
+                        if missing or self._index_key(month, rg) not in self.cache:
+                            fields = [index_column] + [tag_columns[tag][col_type] for tag, col_type in missing]
+                            total += sum(rg_meta.column(col_indices[field]).total_compressed_size for field in fields)
+            else:
+                file_path = self.month_files[month]
+                file_size = os.path.getsize(file_path)
+                with open(file_path, 'rb') as f:
+                    f.seek(-8, os.SEEK_END)
+                    footer_size = int.from_bytes(f.read(4), 'little') + 8
+                month_start = pd.Timestamp(f'{month}01')
+                month_end = month_start + pd.offsets.MonthBegin(1)
+                overlap = (min(end, month_end) - max(start, month_start)) / (month_end - month_start)
+                num_columns = len(types) * max(self.tag_count or len(tags), len(tags)) + 1
+                total += footer_size + (file_size - footer_size) * max(overlap, 0) * (len(types) * len(tags) + 1) / num_columns
+        return int(total)
+    
+    def _index_key(self, month, rg):
+        return (self.prefix, month, rg)
+    
+    def _column_key(self, month, rg, tag, col_type):
+        return (self.prefix, month, rg, tag, col_type)
+    
+    def load(self, tags, start_time, end_time, types=('value', 'quality'), progress=None, cancelled=None,
+             pin=None):
+        """读取时间范围内尚未缓存的row group和tag列，每个月只打开一次文件
+
+        progress(已完成, 总数)在每读完一个row group后调用；cancelled()返回True时
+        抛出LoadCancelled，已经读完的row group保留在缓存中。
+        读完后按内存预算淘汰最久未使用的数据块，本次请求用到的块不会被淘汰；
+        pin不为None时这些块以pin为持有者固定在缓存中，直到cache.unpin(pin)。
+        """
+        months = self.months_between(start_time, end_time)
+        
+        # 先列出所有需要读取的row group，便于报告进度
+        plan = []
+        used_keys = []
+        for month in months:
+            index_column, tag_columns = self.get_layout(month)
+            wanted = [(tag, col_type) for tag in tags for col_type in types
+                      if col_type in tag_columns.get(tag, {})]
+            row_groups = []
+            missing = set()
+            with self.cache.lock:
+                for rg in self.row_groups_between(month, start_time, end_time):
+                    keys = [self._column_key(month, rg, *key) for key in wanted]
+                    used_keys.append(self._index_key(month, rg))
+                    used_keys.extend(keys)
+                    missing_keys = set(self.cache.missing(keys))
+                    rg_missing = [key for key, cache_key in zip(wanted, keys) if cache_key in missing_keys]
+                    if rg_missing or self._index_key(month, rg) not in self.cache:
+                        row_groups.append(rg)
+                        missing.update(rg_missing)
+                    self.cache.touch(keys)
+            if row_groups:
+                plan.append((month, row_groups, [key for key in wanted if key in missing]))
+        
+        total = sum(len(row_groups) for _, row_groups, _ in plan)
+        done = 0
+        for month, row_groups, missing in plan:
+            print(f"加载 {self.prefix}{month} 的 {len(row_groups)} 个row group、{len(missing)} 列")
+            index_column, tag_columns = self.get_layout(month)
+            columns = [index_column] + [tag_columns[tag][col_type] for tag, col_type in missing]
+            parquet_file = self._open(month)
+            for rg in row_groups:
+                if cancelled is not None and cancelled():
+                    raise LoadCancelled()
+                table = parquet_file.read_row_group(rg, columns=columns)
+                with self.cache.lock:
+                    self.cache.put(self._index_key(month, rg),
+                                   table.column(index_column).to_numpy().astype('datetime64[ns]'))
+                    for tag, col_type in missing:
+                        self.cache.put(self._column_key(month, rg, tag, col_type),
+                                       column_to_numpy(table.column(tag_columns[tag][col_type])))
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+        
+        if pin is not None:
+            self.cache.pin(pin, used_keys)
+        self.cache.trim(protected=used_keys)
+    
+    def get_series(self, tag, start_time, end_time, types=('value', 'quality')):
+        """返回tag在[start_time, end_time]内的 (时间, 各type的数组...)，需先调用load"""
+        start = np.datetime64(pd.Timestamp(start_time), 'ns')
+        end = np.datetime64(pd.Timestamp(end_time), 'ns')
+        times = []
+        columns = {col_type: [] for col_type in types}
+        with self.cache.lock:
+            for month in self.months_between(start_time, end_time):
+                for rg in self.row_groups_between(month, start_time, end_time):
+                    index = self.cache.get(self._index_key(month, rg))
+                    chunks = [self.cache.get(self._column_key(month, rg, tag, col_type)) for col_type in types]
+                    if index is None or any(chunk is None for chunk in chunks):
+                        continue
+                    lo = np.searchsorted(index, start, side='left')
+                    hi = np.searchsorted(index, end, side='right')
+                    times.append(index[lo:hi])
+                    for col_type, chunk in zip(types, chunks):
+                        columns[col_type].append(chunk[lo:hi])
+        if not times:
+            return (np.array([], dtype='datetime64[ns]'),) + tuple(np.array([]) for _ in types)
+        return (np.concatenate(times),) + tuple(np.concatenate(columns[col_type]) for col_type in types)
+
+TAG_CATALOG_FILE = 'tag_catalog.json'  # 入库时生成的tag目录，与get_raw_data_ver3.TAG_CATALOG_FILE一致
+PREFIX_STORE_DIR = 'by_prefix'  # 按tag前缀分区的原始数据目录，与get_raw_data_ver3.PREFIX_STORE_DIR一致
+
+def load_tag_catalog(catalog_path):
+    """读取tag目录，不存在或损坏时返回None"""
+    try:
+        with open(catalog_path, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"读取tag目录出错: {catalog_path} - {str(e)}")
+        return None
+    if not isinstance(catalog.get('tags'), dict) or not isinstance(catalog.get('months'), dict):
+        return None
+    return catalog
+
+def glob_to_regex(pattern):
+    """把搜索文本转换为正则表达式：*匹配任意个字符，?匹配一个字符，其他字符按原样匹配；
+    与原来一样不要求匹配整个tag名"""
+    return re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern))
+
+class TagIndex:
+    """按通配符搜索tag用的三字母索引，不区分大小写
+
+    搜索文本中不含通配符的片段先通过三字母索引求出候选tag，再用正则表达式确认；
+    新的搜索文本包含上一次的搜索文本时（例如继续输入），只在上一次的结果中查找
+    """
+    NGRAM = 3
+    
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.names = [tag.lower() for tag in self.tags]
+        self.postings = {}
+        for i, name in enumerate(self.names):
+            for j in range(len(name) - self.NGRAM + 1):
+                self.postings.setdefault(name[j:j + self.NGRAM], set()).add(i)
+        self._last_query = None
+        self._last_result = None
+    
+    def search(self, text):
+        """返回匹配的tag集合，搜索文本为空时返回None表示全部显示"""
+        query = text.lower()
+        if not query:
+            self._last_query = self._last_result = None
+            return None
+        
+        if self._last_query is not None and self._last_query in query:
+            candidates = self._last_result
+        else:
+            candidates = None
+            for literal in re.split(r'[*?]', query):
+                for j in range(len(literal) - self.NGRAM + 1):
+                    ids = self.postings.get(literal[j:j + self.NGRAM], set())
+                    candidates = set(ids) if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = range(len(self.names))
+        
+        regex = glob_to_regex(query)
+        result = {i for i in candidates if regex.search(self.names[i])}
+        self._last_query, self._last_result = query, result
+        return {self.tags[i] for i in result}
+
+class TagFilterProxy(QSortFilterProxyModel):
+    """按搜索结果过滤tag树，visible_tags为None时全部显示；有可见tag的前缀分组自动显示"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.visible_tags = None
+        self.setRecursiveFilteringEnabled(True)
+    
+    def set_visible_tags(self, visible_tags):
+        """一次更新所有行的可见性"""
+        self.visible_tags = visible_tags
+        self.invalidateFilter()
+    
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.visible_tags is None:
+            return True
+        if not source_parent.isValid():
+            return False
+        return self.sourceModel().index(source_row, 0, source_parent).data() in self.visible_tags
+
+SEARCH_DELAY_MS = 150  # 停止输入多久后再搜索
+
+class SparseStore(DataStore):
+    """读取入库时可选生成的变化存储 sparse_<yyyymm>.parquet
+
+    每行是某个tag从某个时刻开始的新值 (tag, timestamp, value, quality)，按tag、时间排序；
+    每个月的文件都从该月第一行的值开始，可以单独还原。按tag列的统计信息只读取包含所选tag的row group，
+    每个 (月份, tag) 的整月变化点一起缓存，数据量很小。
+    入库时死区大于0的tag的变化点与原始值最多相差死区，绘图时在游标读数和标注中注明死区。
+    """
+    def __init__(self, data_dir='.', prefix='sparse_', cache=None):
+        super().__init__(data_dir, prefix, cache)
+        self._sparse_meta = {}  # month -> (收录的tag集合, 本月最后的时间戳, {tag: 死区})
+    
+    def get_layout(self, month):
+        return 'timestamp', {}
+    
+    def get_sparse_meta(self, month):
+        """文件元数据中记录的收录tag、本月最后的时间戳（最后一段阶梯的终点）和死区大于0的tag的死区"""
+        if month not in self._sparse_meta:
+            key_values = self._open(month).metadata.metadata or {}
+            last_time = key_values.get(b'last_timestamp', b'')
+            self._sparse_meta[month] = (set(json.loads(key_values.get(b'sparse_tags', b'[]'))),
+                                        np.datetime64(int(last_time), 'ns') if last_time else None,
+                                        json.loads(key_values.get(b'sparse_deadbands', b'{}')))
+        return self._sparse_meta[month]
+    
+    def deadband(self, tag, months):
+        """入库时这个tag在这些月份中最大的死区，精确记录时为0"""
+        return max((self.get_sparse_meta(month)[2].get(tag, 0.0) for month in months), default=0.0)
+    
+    def covered_tags(self, tags, months):
+        """在所有这些月份都有变化存储的tag"""
+        if not months or any(month not in self.month_files for month in months):
+            return []
+        return [tag for tag in tags if all(tag in self.get_sparse_meta(month)[0] for month in months)]
+    
+    def _tag_row_groups(self, month, tags):
+        """按tag列的min/max统计找出可能包含这些tag的row group"""
+        metadata = self._open(month).metadata
+        col_idx = metadata.schema.names.index('tag')
+        row_groups = []
+        for rg in range(metadata.num_row_groups):
+            stats = metadata.row_group(rg).column(col_idx).statistics
+            if stats is None or not stats.has_min_max or any(stats.min <= tag <= stats.max for tag in tags):
+                row_groups.append(rg)
+        return row_groups
+    
+    def load(self, tags, start_time, end_time, types=None, progress=None, cancelled=None, pin=None):
+        """读取时间范围内各月尚未缓存的tag的整月变化点，pin的用法与DataStore.load相同"""
+        months = self.months_between(start_time, end_time)
+        used_keys = []
+        plan = []
+        for month in months:
+            keys = {tag: [self._column_key(month, None, tag, col_type) for col_type in ('timestamp', 'value', 'quality')]
+                    for tag in tags}
+            used_keys.extend(key for tag_keys in keys.values() for key in tag_keys)
+            missing = [tag for tag in tags if self.cache.missing(keys[tag])]
+            if missing:
+                plan.append((month, missing))
+        self.cache.touch(used_keys)
+        
+        for done, (month, missing) in enumerate(plan):
+            if cancelled is not None and cancelled():
+                raise LoadCancelled()
+            print(f"加载 {self.prefix}{month} 中 {len(missing)} 个tag的变化点")
+            table = self._open(month).read_row_groups(self._tag_row_groups(month, missing))
+            tag_column = table.column('tag').cast(pa.string())
+            for tag in missing:
+                rows = table.filter(pc.equal(tag_column, tag))
+                with self.cache.lock:
+                    self.cache.put(self._column_key(month, None, tag, 'timestamp'),
+                                   rows.column('timestamp').to_numpy().astype('datetime64[ns]'))
+                    self.cache.put(self._column_key(month, None, tag, 'value'), column_to_numpy(rows.column('value')))
+                    self.cache.put(self._column_key(month, None, tag, 'quality'), column_to_numpy(rows.column('quality')))
+            if progress is not None:
+                progress(done + 1, len(plan))
+        
+        if pin is not None:
+            self.cache.pin(pin, used_keys)
+        self.cache.trim(protected=used_keys)
+    
+    def get_series(self, tag, start_time, end_time, types=None):
+        """返回 (变化时间, 数值, 质量码, 终点时间)
+
+        第一个点是start_time时生效的值，时间改为start_time；终点时间是end_time和数据最后时间中较早的一个
+        """
+        start = np.datetime64(pd.Timestamp(start_time), 'ns')
+        end = np.datetime64(pd.Timestamp(end_time), 'ns')
+        times, values, qualities = [], [], []
+        last_time = None
+        with self.cache.lock:
+            for month in self.months_between(start_time, end_time):
+                chunks = [self.cache.get(self._column_key(month, None, tag, col_type))
+                          for col_type in ('timestamp', 'value', 'quality')]
+                if any(chunk is None for chunk in chunks):
+                    continue
+                times.append(chunks[0])
+                values.append(chunks[1])
+                qualities.append(chunks[2])
+                last_time = self.get_sparse_meta(month)[1]
+        if not times:
+            return np.array([], dtype='datetime64[ns]'), np.array([]), np.array([], dtype=np.int64), end
+        times, values, qualities = np.concatenate(times), np.concatenate(values), np.concatenate(qualities)
+        first = max(int(np.searchsorted(times, start, side='right')) - 1, 0)
+        last = int(np.searchsorted(times, end, side='right'))
+        times = times[first:last].copy()
+        end_point = min(end, last_time) if last_time is not None else end
+        if len(times):
+            times[0] = max(times[0], start)
+            end_point = max(end_point, times[-1])
+        return times, values[first:last], qualities[first:last], end_point
+
+def step_points(times, values, qualities, end_point):
+    """把变化点展开成阶梯曲线的顶点：每个值一直保持到下一个变化点，最后一个值保持到end_point"""
+    if len(times) == 0:
+        return times, values, qualities
+    step_times = np.column_stack([times, np.r_[times[1:], np.array([end_point], dtype=times.dtype)]]).ravel()
+    return step_times, np.repeat(values, 2), np.repeat(qualities, 2)
+
+# 默认Y轴范围的取法: (显示名称, 统计文件中的下限列, 上限列)
+RANGE_MODES = [
+    ('最小/最大', 'min', 'max'),
+    ('P1-P99', 'p1', 'p99'),
+    ('P5-P95', 'p5', 'p95'),
+]
+
+class StatsCatalog:
+    """读取入库时生成的每月统计文件 stats_<yyyymm>.parquet，每个月只读一次"""
+    def __init__(self, data_dir='.', prefix='stats_'):
+        self.data_dir = data_dir
+        self.prefix = prefix
+        self._months = {}  # month -> 以tag为索引的统计表
+    
+    def get_month(self, month):
+        """返回某个月的统计表，没有统计文件时返回None"""
+        if month not in self._months:
+            path = os.path.join(self.data_dir, f'{self.prefix}{month}.parquet')
+            try:
+                self._months[month] = pq.read_table(path).to_pandas().set_index('tag')
+            except (FileNotFoundError, OSError):
+                self._months[month] = None
+        return self._months[month]
+    
+    def get_ranges(self, tags, months, mode=RANGE_MODES[0]):
+        """按统计文件给出各tag在这些月份的范围 {tag: (下限, 上限)}
+
+        多个月时下限取各月下限的最小值、上限取最大值；有月份缺少统计文件时返回空字典，
+        没有统计信息的tag不在结果中
+        """
+        _, low_column, high_column = mode
+        tables = [self.get_month(month) for month in months]
+        if not tables or any(table is None for table in tables):
+            return {}
+        ranges = {}
+        for tag in tags:
+            tag_tables = [table for table in tables if tag in table.index]
+            if tag_tables:
+                lows = np.array([table.at[tag, low_column] for table in tag_tables], dtype=np.float64)
+                highs = np.array([table.at[tag, high_column] for table in tag_tables], dtype=np.float64)
+                ranges[tag] = (np.fmin.reduce(lows), np.fmax.reduce(highs))
+        return ranges
+
+PERF_LOG_FILE = 'viewer_perf.log'  # 每帧各步骤耗时的日志，按大小轮换
+PERF_LOG_MAX_BYTES = 1024 * 1024
+PERF_LOG_BACKUPS = 3
+# 一帧中计时的步骤：后台加载、取出时间范围并区分正常/异常点、抽稀、更新曲线和坐标轴、调整布局、重画画布
+PERF_STEPS = [('load', '加载'), ('slice', '切片'), ('decimate', '抽稀'), ('plot', '曲线'),
+              ('tight_layout', '布局'), ('draw', '重画')]
+
+class PerfFrame:
+    """一帧（一次update_plot从提交请求到画完）中各步骤的耗时和数量
+
+    加载在后台线程、其余步骤在界面线程中计时，同一帧的步骤不会同时执行
+    """
+    def __init__(self, **info):
+        self.info = info
+        self.seconds = {step: 0.0 for step, _ in PERF_STEPS}
+        self.counts = {'rows': 0, 'points': 0, 'cache_hits': 0, 'cache_misses': 0}
+        self.start = time.perf_counter()
+        self.total = None
+    
+    @contextmanager
+    def timer(self, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[step] += time.perf_counter() - start
+    
+    @contextmanager
+    def load_timer(self, cache):
+        """计时加载，并记下这次加载中数据块缓存的命中和未命中次数"""
+        hits, misses = cache.hits, cache.misses
+        with self.timer('load'):
+            yield
+        self.counts['cache_hits'] += cache.hits - hits
+        self.counts['cache_misses'] += cache.misses - misses
+    
+    def cache_hit_rate(self):
+        total = self.counts['cache_hits'] + self.counts['cache_misses']
+        return self.counts['cache_hits'] / total if total else None
+    
+    def log_line(self):
+        """一行 键=值 格式的记录"""
+        fields = [f"{key}={value}" for key, value in self.info.items()]
+        fields += [f"{step}={self.seconds[step] * 1000:.1f}ms" for step, _ in PERF_STEPS]
+        fields.append(f"total={self.total * 1000:.1f}ms")
+        fields += [f"{key}={value}" for key, value in self.counts.items()]
+        return ' '.join(fields)
+
+class PerfMonitor:
+    """记录每帧各步骤的耗时：界面线程中的步骤计入正在绘制的帧，画完的帧写入按大小轮换的日志文件
+
+    log_file为None时不写日志
+    """
+    def __init__(self, log_file=PERF_LOG_FILE):
+        self.current = None
+        self.last = None
+        self.logger = logging.getLogger('data_viewer.perf')
+        self.logger.propagate = False
+        if log_file and not self.logger.handlers:
+            handler = RotatingFileHandler(log_file, maxBytes=PERF_LOG_MAX_BYTES, backupCount=PERF_LOG_BACKUPS,
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+    
+    def timer(self, step):
+        """计入正在绘制的帧；不在绘制一帧的过程中时（如填写默认范围）不记录"""
+        return (self.current or PerfFrame()).timer(step)
+    
+    def count(self, name, n):
+        if self.current is not None:
+            self.current.counts[name] += n
+    
+    def finish(self, frame):
+        frame.total = time.perf_counter() - frame.start
+        self.current = None
+        self.last = frame
+        self.logger.info(frame.log_line())
+
 class DataViewer(QMainWindow):
-    def __init__(self):
+    def __init__(self, cache_budget_mb=CACHE_BUDGET_MB, perf_log=PERF_LOG_FILE):
         super().__init__()
         self.setWindowTitle("数据查看器")
         self.setGeometry(100, 100, 1200, 800)
@@ -38,15 +794,15 @@ class DataViewer(QMainWindow):
                 background-color: #2b2b2b;
                 color: #ffffff;
             }
-            QTreeWidget {
+            QTreeView {
                 background-color: #363636;
                 color: #ffffff;
                 border: 1px solid #555555;
             }
-            QTreeWidget::item:selected {
+            QTreeView::item:selected {
                 background-color: #4a4a4a;
             }
-            QTreeWidget::item {
+            QTreeView::item {
                 color: #ffffff;
             }
             QHeaderView::section {
@@ -85,10 +841,14 @@ class DataViewer(QMainWindow):
             }
         """)
         
-        # 加载数据
-        self.df = None
-        self.loaded_months = set()  # 用于跟踪已加载的月份
-        self.load_initial_data()  # 替换原来的 load_data()
+        # 加载数据（启动时只读取文件结构，数据按选中的tag在后台按需加载）
+        self.cache_budget_mb = cache_budget_mb
+        self.perf = PerfMonitor(perf_log)
+        self.store = None
+        self.load_initial_data()
+        self.loader = DataLoader(self)
+        self.loader.progress.connect(self.on_load_progress)
+        self.loader.failed.connect(self.on_load_failed)
         
         # 创建主布局
         main_layout = QHBoxLayout()
@@ -107,7 +867,7 @@ class DataViewer(QMainWindow):
         self.start_time_edit = QDateTimeEdit()
         self.start_time_edit.setDateTime(
             QDateTime.fromString(
-                self.df.index.min().strftime("%Y-%m-%d %H:%M:%S"),
+                self.data_start.strftime("%Y-%m-%d %H:%M:%S"),
                 "yyyy-MM-dd HH:mm:ss"
             )
         )
@@ -132,7 +892,7 @@ class DataViewer(QMainWindow):
         self.end_time_edit = QDateTimeEdit()
         self.end_time_edit.setDateTime(
             QDateTime.fromString(
-                self.df.index.max().strftime("%Y-%m-%d %H:%M:%S"),
+                self.data_end.strftime("%Y-%m-%d %H:%M:%S"),
                 "yyyy-MM-dd HH:mm:ss"
             )
         )
@@ -163,13 +923,27 @@ class DataViewer(QMainWindow):
         search_layout = QHBoxLayout()
         self.search_box = QLineEdit()
         self.search_box.setPlaceholderText("搜索标签...")
-        self.search_box.textChanged.connect(self.filter_tags)
         search_layout.addWidget(self.search_box)
         
-        # 数据点选择（不设置标题）
-        self.tag_tree = QTreeWidget()
+        # 输入停止一段时间后才搜索，连续输入时不会每个字都过滤一次
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(lambda: self.filter_tags(self.search_box.text()))
+        self.search_box.textChanged.connect(self.search_timer.start)
+        
+        # 数据点选择（不设置标题），树形模型经过滤代理显示
+        self.tag_model = QStandardItemModel(self)
+        self.tag_proxy = TagFilterProxy(self)
+        self.tag_proxy.setSourceModel(self.tag_model)
+        self.tag_tree = QTreeView()
+        self.tag_tree.setModel(self.tag_proxy)
         self.tag_tree.setHeaderHidden(True)  # 隐藏标题
-        self.tag_tree.setSelectionMode(QTreeWidget.SelectionMode.MultiSelection)
+        self.tag_tree.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
+        self.tag_tree.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        # 选中的tag另外记录，搜索把它们暂时隐藏后也不会丢失
+        self.selected_tag_set = set()
+        self.syncing_selection = False
         self.populate_tag_tree()
         
         # 添加控制选项
@@ -181,6 +955,11 @@ class DataViewer(QMainWindow):
         self.screenshot_button.clicked.connect(self.save_screenshot)
         options_layout.addWidget(self.screenshot_button)
         
+        # 是否在图表下方显示每帧的性能统计
+        self.perf_checkbox = QCheckBox("性能统计")
+        self.perf_checkbox.toggled.connect(self.on_perf_toggled)
+        options_layout.addWidget(self.perf_checkbox)
+        
         # 修改按钮布局为网格布局
         button_layout = QVBoxLayout()  # 改为垂直布局来容纳两行按钮
         
@@ -229,6 +1008,10 @@ class DataViewer(QMainWindow):
         self.figure = Figure(figsize=(10, 6))
         self.canvas = FigureCanvas(self.figure)
         plot_layout.addWidget(self.canvas)
+        self.perf_label = QLabel()
+        self.perf_label.setStyleSheet("font-family: monospace; color: #aaaaaa;")
+        self.perf_label.hide()
+        plot_layout.addWidget(self.perf_label)
         
         # 创建右侧范围控制面板
         range_panel = QWidget()
@@ -239,6 +1022,13 @@ class DataViewer(QMainWindow):
         range_title = QLabel("数据范围控制")
         self.range_layout.addWidget(range_title)
         
+        # 默认范围的取法，切换后重新填写所有范围
+        self.range_mode_combo = QComboBox()
+        for name, _, _ in RANGE_MODES:
+            self.range_mode_combo.addItem(name)
+        self.range_mode_combo.currentIndexChanged.connect(self.on_range_mode_changed)
+        self.range_layout.addWidget(self.range_mode_combo)
+        
         # 设置整体布局
         main_layout.addWidget(control_panel, 1)
         main_layout.addWidget(plot_panel, 4)
@@ -249,195 +1039,531 @@ class DataViewer(QMainWindow):
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
         
+        # 状态栏显示后台加载进度
+        self.load_status = QLabel()
+        self.load_progress = QProgressBar()
+        self.load_progress.setMaximumWidth(200)
+        self.load_progress.setTextVisible(False)
+        self.statusBar().addPermanentWidget(self.load_status)
+        self.statusBar().addPermanentWidget(self.load_progress)
+        self.load_progress.hide()
+        
         # 存储范围控制器
         self.range_controls = {}
         
+        # 已绘制的坐标轴 [(ax, 正常点曲线, 异常点曲线)]，按位置复用
+        self.plot_axes = []
+        self.plot_layout_key = None
+        self.drawn_request = None
+        
+        # 游标查询用的曲线: [(ax, line, 有序int64纳秒时间索引, 数值, 阶梯曲线的终点纳秒或None)]
+        self.cursor_series = []
+        self.cursor_tolerance_ns = CURSOR_TOLERANCE_SECONDS * 10**9
+        
         # 初始绘图
         self.update_plot()
         
         # 添加树形控件选择变更信号连接
-        self.tag_tree.itemSelectionChanged.connect(self.on_selection_changed)
+        self.tag_tree.selectionModel().selectionChanged.connect(self.on_tree_selection_changed)
         
         # 添加用于跟踪垂直线和数据点标注的属性
+        # 这些都是animated的覆盖层，不参与整图重绘，在缓存的背景上单独blit
         self.vline = None
+        self.hover_line = None
         self.data_annotations = []
+        self.plot_background = None
         
-        # 连接鼠标事件
+        # 连接鼠标事件，鼠标移动时游标线跟随并在状态栏显示游标处的数值
         self.canvas.mpl_connect('button_press_event', self.on_mouse_click)
+        self.canvas.mpl_connect('motion_notify_event', self.on_mouse_move)
+        self.canvas.mpl_connect('draw_event', self.on_canvas_draw)
+        
+        # 滚轮缩放、左键拖动平移；先移动已有的曲线，停下后再按新的时间范围加载数据
+        self.pan_origin = None
+        self.navigate_timer = QTimer(self)
+        self.navigate_timer.setSingleShot(True)
+        self.navigate_timer.setInterval(NAVIGATE_DELAY_MS)
+        self.navigate_timer.timeout.connect(self.update_plot)
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_pan_press)
+        self.canvas.mpl_connect('button_release_event', self.on_pan_release)
     
     def load_initial_data(self):
-        """只加载最近一个月的数据"""
+        """启动时从tag目录读取tag列表和最近一个月的时间范围，不打开数据文件；
+        没有tag目录或目录中没有最新的月份时，读取最近一个月数据文件的schema和时间范围"""
         print("开始加载初始数据...")
-        data_files = sorted([f for f in os.listdir('.') if f.startswith('data_matrix_') and f.endswith('.parquet')])
-        if not data_files:
+        self.cache = ChunkCache(self.cache_budget_mb * 1024 * 1024)
+        self.store = DataStore('.', cache=self.cache)
+        self.stats = StatsCatalog('.')
+        self.sparse_store = SparseStore('.', cache=self.cache)
+        if not self.store.months:
             raise FileNotFoundError("未找到任何数据文件")
         
-        # 加载最新的数据文件
-        latest_file = data_files[-1]
-        print(f"正在加载最新数据: {latest_file}")
-        self.df = pd.read_parquet(latest_file)
-        
-        # 从文件名中提取月份 (data_matrix_YYYYMM.parquet)
-        month = latest_file.replace('data_matrix_', '').replace('.parquet', '')
-        self.loaded_months.add(month)  # 直接使用YYYYMM格式
-        print(f"初始数据加载完成，数据量: {len(self.df)} 行")
-    
-    def load_data_for_timerange(self, start_time, end_time):
-        """根据时间范围按需加载数据,最多保留两个月"""
-        start_month = start_time.strftime('%Y%m')
-        end_month = end_time.strftime('%Y%m')
-        
-        # 检查是否需要加载新数据
-        months_needed = set()
-        current = pd.Timestamp(start_time)
-        while current <= end_time:
-            month_key = current.strftime('%Y%m')
-            if month_key not in self.loaded_months:
-                months_needed.add(month_key)
-            current += pd.offsets.MonthEnd(1)
-        
-        if not months_needed:
+        latest_month = self.store.months[-1]
+        catalog = load_tag_catalog(os.path.join('.', TAG_CATALOG_FILE))
+        if catalog is not None and latest_month in catalog['months']:
+            print(f"正在读取tag目录: {TAG_CATALOG_FILE}")
+            self.tag_catalog = catalog['tags']
+            self.tags = list(self.tag_catalog)
+            month_info = catalog['months'][latest_month]
+            self.data_start, self.data_end = pd.Timestamp(month_info['start']), pd.Timestamp(month_info['end'])
+        else:
+            # 从最新的数据文件读取tag列表和时间范围
+            print(f"正在读取最新数据的结构: {self.store.month_files[latest_month]}")
+            self.tag_catalog = {}
+            self.tags = self.store.get_tags(latest_month)
+            self.data_start, self.data_end = self.store.get_time_bounds(latest_month)
+        
+        # 汇总数据，时间范围较长时代替原始数据绘图
+        self.rollup_stores = {}
+        for name, bucket_seconds in ROLLUP_LEVELS:
+            store = DataStore('.', prefix=f'rollup_{name}_', cache=self.cache)
+            if store.months:
+                self.rollup_stores[name] = (bucket_seconds, store)
+        
+        # 按tag前缀分区的原始数据，只看少数几个tag时读取量可能比月度文件少得多
+        self.prefix_stores = {}
+        prefix_dir = os.path.join('.', PREFIX_STORE_DIR)
+        if os.path.isdir(prefix_dir):
+            prefixes = {f[len('data_'):-len('_YYYYMM.parquet')] for f in os.listdir(prefix_dir)
+                        if f.startswith('data_') and f.endswith('.parquet')}
+            for prefix in sorted(prefixes):
+                store = DataStore(prefix_dir, prefix=f'data_{prefix}_', cache=self.cache)
+                if store.months:
+                    store.tag_count = sum(tag.split('-')[0] == prefix for tag in self.tags)
+                    self.prefix_stores[prefix] = store
+        self.store.tag_count = len(self.tags)
+        print(f"初始数据加载完成，共 {len(self.tags)} 个tag")
+    
+    def load_data_for_timerange(self, start_time, end_time, tags, level=None, progress=None, cancelled=None,
+                                layout='matrix', pin=None):
+        """根据时间范围按需加载选中tag的数据；level为汇总层级时加载汇总数据
+
+        在整个时间范围内都有变化存储的tag只读取变化点；原始数据按layout从月度文件或按前缀分区的文件读取。
+        pin不为None时加载的数据固定在缓存中，直到cache.unpin(pin)
+        """
+        sparse_tags = self.sparse_tags(start_time, end_time, tags)
+        if sparse_tags:
+            self.sparse_store.load(sparse_tags, start_time, end_time, progress=progress, cancelled=cancelled, pin=pin)
+            tags = [tag for tag in tags if tag not in sparse_tags]
+            if not tags:
+                return
+        if level is None:
+            for store, store_tags in self.raw_stores(tags, layout).items():
+                store.load(store_tags, start_time, end_time, progress=progress, cancelled=cancelled, pin=pin)
+        else:
+            self.rollup_stores[level][1].load(tags, start_time, end_time, ROLLUP_PLOT_TYPES,
+                                              progress=progress, cancelled=cancelled, pin=pin)
+    
+    def raw_stores(self, tags, layout):
+        """{读取原始数据的DataStore: tag列表}"""
+        if layout != 'prefix':
+            return {self.store: list(tags)}
+        groups = {}
+        for tag in tags:
+            groups.setdefault(self.prefix_stores[tag.split('-')[0]], []).append(tag)
+        return groups
+    
+    def choose_raw_layout(self, start_time, end_time, tags):
+        """原始数据从月度文件('matrix')还是按前缀分区的文件('prefix')读取
+
+        分别估计两种存储还需要从磁盘读取的字节数（已缓存的数据不计），取较少的一种；
+        分区文件必须覆盖选中tag的所有前缀和时间范围内所有有原始数据的月份
+        """
+        prefixes = {tag.split('-')[0] for tag in tags}
+        if not self.prefix_stores or not prefixes.issubset(self.prefix_stores):
+            return 'matrix'
+        raw_months = self.store.months_between(start_time, end_time)
+        if any(self.prefix_stores[prefix].months_between(start_time, end_time) != raw_months for prefix in prefixes):
+            return 'matrix'
+        matrix_bytes = self.store.estimate_read_bytes(tags, start_time, end_time)
+        prefix_bytes = sum(store.estimate_read_bytes(store_tags, start_time, end_time)
+                           for store, store_tags in self.raw_stores(tags, 'prefix').items())
+        return 'prefix' if prefix_bytes < matrix_bytes else 'matrix'
+    
+    def sparse_tags(self, start_time, end_time, tags):
+        """时间范围内每个有数据的月份都有变化存储的tag"""
+        return self.sparse_store.covered_tags(tags, self.store.months_between(start_time, end_time))
+    
+    def on_load_progress(self, kind, done, total):
+        """在状态栏显示后台加载进度，预读不显示"""
+        if kind == 'prefetch':
             return
-        
-        # 如果需要加载的月份会导致超过两个月,先删除最旧的月份
-        while len(self.loaded_months) + len(months_needed) > 2:
-            oldest_month = min(self.loaded_months)
-            print(f"移除旧数据: {oldest_month}")
-            # 找到并删除这个月的数据
-            month_start = pd.Timestamp(f"{oldest_month}01")
-            month_end = month_start + pd.offsets.MonthEnd(1)
-            self.df = self.df[~((self.df.index >= month_start) & (self.df.index <= month_end))]
-            self.loaded_months.remove(oldest_month)
-        
-        # 加载新的数据文件
-        for month in months_needed:
-            filename = f'data_matrix_{month}.parquet'
-            if os.path.exists(filename):
-                print(f"加载新数据: {filename}")
-                new_df = pd.read_parquet(filename)
-                if self.df is None:
-                    self.df = new_df
-                else:
-                    self.df = pd.concat([self.df, new_df])
-                self.loaded_months.add(month)
-        
-        # 只排序,不裁剪时间范围
-        if self.df is not None:
-            self.df.sort_index(inplace=True)
+        self.load_status.setText(f"正在加载数据 {done}/{total}")
+        self.load_progress.setMaximum(total)
+        self.load_progress.setValue(done)
+        self.load_progress.show()
+    
+    def on_load_done(self):
+        if not self.loader.is_busy('plot') and not self.loader.is_busy('ranges'):
+            self.load_status.setText("")
+            self.load_progress.hide()
+    
+    def on_load_failed(self, kind, error):
+        """后台加载出错：释放请求固定的数据，复位进度条和加载状态，预读以外的请求弹出错误提示"""
+        self.cache.unpin(kind)
+        self.on_load_done()
+        if kind != 'prefetch':
+            QMessageBox.warning(self, "加载数据出错", str(error))
+    
+    def choose_rollup_level(self, start_time, end_time, num_points):
+        """选择时间桶数量仍不少于num_points的最粗汇总层级，都不满足时返回None使用原始数据
+
+        汇总文件必须覆盖时间范围内所有有原始数据的月份，否则也使用原始数据
+        """
+        span_seconds = (end_time - start_time).total_seconds()
+        raw_months = self.store.months_between(start_time, end_time)
+        for name, bucket_seconds in reversed(ROLLUP_LEVELS):
+            if name not in self.rollup_stores or span_seconds / bucket_seconds < num_points:
+                continue
+            if self.rollup_stores[name][1].months_between(start_time, end_time) == raw_months:
+                return name
+        return None
+    
+    def get_raw_series(self, tag_name, start_time, end_time, layout='matrix'):
+        """从已加载的原始数据中取一个tag的 (时间, 数值, 质量码, 变化点)，存储的选择与load_data_for_timerange相同
+
+        有变化存储的tag把变化点还原成阶梯曲线，变化点为 (变化时间, 数值, 质量码, 终点时间)；
+        其他tag按layout从月度文件或按前缀分区的文件取数据，变化点为None
+        """
+        if self.sparse_tags(start_time, end_time, [tag_name]):
+            steps = self.sparse_store.get_series(tag_name, start_time, end_time)
+            return (*step_points(*steps), steps)
+        store, = self.raw_stores([tag_name], layout)
+        return (*store.get_series(tag_name, start_time, end_time), None)
+    
+    def get_plot_data(self, tag_name, start_time, end_time, level, num_buckets, layout='matrix'):
+        """取一个tag要绘制的点，返回 (正常点时间, 正常点数值, 异常点时间, 异常点数值, 变化点)，绘制的点均已抽稀
+
+        变化点只对稀疏存储的tag给出，为 (变化时间, 数值, 质量码, 终点时间)，供游标查找某时刻生效的值；其他tag为None
+        """
+        sparse = bool(self.sparse_tags(start_time, end_time, [tag_name]))
+        steps = None
+        with self.perf.timer('slice'):
+            if level is None or sparse:
+                times, data, quality, steps = self.get_raw_series(tag_name, start_time, end_time, layout)
+                # 区分正常数据和异常数据，分别抽稀，异常点的尖峰同样保留
+                good_idx = np.flatnonzero(quality == 0)
+                bad_idx = np.flatnonzero(quality != 0)
+                good_times, good_data = times[good_idx], data[good_idx]
+                bad_times, bad_data = times[bad_idx], data[bad_idx]
+            else:
+                times, mins, maxs, lasts, bads = self.rollup_stores[level][1].get_series(
+                    tag_name, start_time, end_time, ROLLUP_PLOT_TYPES)
+                # 每个时间桶画最小值和最大值两个点，保留数据的包络；有异常质量码的桶在最后值处标记
+                good_times = np.repeat(times, 2)
+                good_data = np.column_stack([mins, maxs]).ravel()
+                bad_mask = bads > 0
+                bad_times, bad_data = times[bad_mask], lasts[bad_mask]
+        self.perf.count('rows', len(times))
+        
+        with self.perf.timer('decimate'):
+            good_keep = decimate_minmax(good_times, good_data, num_buckets, start_time, end_time)
+            bad_keep = decimate_minmax(bad_times, bad_data, num_buckets, start_time, end_time)
+        return good_times[good_keep], good_data[good_keep], bad_times[bad_keep], bad_data[bad_keep], steps
     
     def populate_tag_tree(self):
-        """填充数据点树形结构"""
+        """填充数据点树形结构并建立搜索索引"""
         # 创建前缀字典
         prefix_dict = {}
-        for tag in sorted(self.df.columns.get_level_values('tag').unique()):
-            # 使用'-'分割标签名，取第一部分作为前缀
-            prefix = tag.split('-')[0]
+        for tag in sorted(set(self.tags)):
+            # 优先用tag目录中的前缀，否则使用'-'分割标签名，取第一部分作为前缀
+            prefix = self.tag_catalog.get(tag, {}).get('prefix') or tag.split('-')[0]
             if prefix not in prefix_dict:
                 prefix_dict[prefix] = []
             prefix_dict[prefix].append(tag)
         
         # 创建树形结构
+        self.tag_order = []
+        root = self.tag_model.invisibleRootItem()
         for prefix, tags in sorted(prefix_dict.items()):
-            prefix_item = QTreeWidgetItem(self.tag_tree)
-            prefix_item.setText(0, prefix)
+            prefix_item = QStandardItem(prefix)
             for tag in sorted(tags):
-                tag_item = QTreeWidgetItem(prefix_item)
-                tag_item.setText(0, tag)
+                tag_item = QStandardItem(tag)
+                entry = self.tag_catalog.get(tag)
+                if entry:
+                    tag_item.setToolTip(f"{entry['first_month']} - {entry['last_month']}  {entry.get('dtype', '')}")
+                prefix_item.appendRow(tag_item)
+                self.tag_order.append(tag)
+            root.appendRow(prefix_item)
+        self.tag_index = TagIndex(self.tag_order)
     
     def get_selected_tags(self):
-        """获取选中的数据点"""
-        selected_tags = []
-        iterator = QTreeWidgetItemIterator(self.tag_tree, QTreeWidgetItemIterator.IteratorFlag.Selected)
-        while iterator.value():
-            item = iterator.value()
-            if item.childCount() == 0:
-                selected_tags.append(item.text(0))
-            iterator += 1
-        return selected_tags
+        """获取选中的数据点，按树中的顺序"""
+        return [tag for tag in self.tag_order if tag in self.selected_tag_set]
+    
+    def on_tree_selection_changed(self, selected, deselected):
+        """记录用户在树中选中或取消的tag（前缀分组不算）"""
+        if self.syncing_selection:
+            return
+        for index in selected.indexes():
+            if index.parent().isValid():
+                self.selected_tag_set.add(index.data())
+        for index in deselected.indexes():
+            if index.parent().isValid():
+                self.selected_tag_set.discard(index.data())
+        self.on_selection_changed()
+    
+    def sync_tree_selection(self):
+        """让树中可见行的选中状态与selected_tag_set一致，一次提交整个选择"""
+        selection = QItemSelection()
+        for row in range(self.tag_proxy.rowCount()):
+            group = self.tag_proxy.index(row, 0)
+            for child_row in range(self.tag_proxy.rowCount(group)):
+                index = self.tag_proxy.index(child_row, 0, group)
+                if index.data() in self.selected_tag_set:
+                    selection.select(index, index)
+        self.syncing_selection = True
+        try:
+            self.tag_tree.selectionModel().select(selection, QItemSelectionModel.SelectionFlag.ClearAndSelect)
+        finally:
+            self.syncing_selection = False
+    
+    def select_tags(self, tags):
+        """选中给定的tag（追加到已有选择）"""
+        self.selected_tag_set.update(tag for tag in tags if tag in self.tag_index.tags)
+        self.sync_tree_selection()
+        self.on_selection_changed()
     
     def update_plot(self):
         # 获取选择的间范围和数据点
         start_time = self.start_time_edit.dateTime().toPyDateTime()
         end_time = self.end_time_edit.dateTime().toPyDateTime()
         
-        # 检查加载需要的数据
-        self.load_data_for_timerange(start_time, end_time)
-        
         selected_tags = self.get_selected_tags()
         
         if not selected_tags:
             return
         
-        # 清除旧图
-        self.figure.clear()
-        ax = self.figure.add_subplot(111)
+        # 按画布宽度(像素)抽稀，每个像素最多保留最小、最大两个点
+        num_buckets = max(int(self.figure.bbox.width), 100)
+        
+        # 时间范围较长时使用点数仍足够的最粗汇总层级；使用原始数据时选择需要读取的字节数较少的存储
+        level = self.choose_rollup_level(start_time, end_time, num_buckets)
+        layout = self.choose_raw_layout(start_time, end_time, selected_tags) if level is None else 'matrix'
+        
+        # 数据没有变化（例如只修改了Y轴范围）时不用重新取数据，只更新坐标轴范围
+        request = (start_time, end_time, tuple(selected_tags), level, num_buckets)
+        if request == self.drawn_request and not self.loader.is_busy('plot'):
+            for (curr_ax, _, _), tag_name in zip(self.plot_axes, selected_tags):
+                self.apply_y_range(curr_ax, tag_name)
+            self.canvas.draw_idle()
+            return
+        
+        # 在后台加载需要的数据，加载完成后再绘图；时间范围改变后未完成的旧请求和预读会被取消
+        # 性能统计中记下实际读取的存储：变化存储的tag为sparse，其他tag为汇总文件或layout选出的原始数据存储
+        sparse_tags = self.sparse_tags(start_time, end_time, selected_tags)
+        stores = ['sparse'] if sparse_tags else []
+        if len(sparse_tags) < len(selected_tags):
+            stores.append(layout if level is None else 'rollup')
+        frame = PerfFrame(tags=len(selected_tags), span=str(pd.Timestamp(end_time) - pd.Timestamp(start_time)),
+                          level=level or 'raw', layout='+'.join(stores))
+        
+        # 加载完的数据在绘出之前一直固定在缓存中，期间其他请求（如默认范围）淘汰数据时不会淘汰它们；
+        # 绘图请求在同一个后台线程中依次执行，新的请求开始加载时释放被取代的请求固定的数据
+        def load(progress, cancelled):
+            self.cache.unpin('plot')
+            with frame.load_timer(self.cache):
+                self.load_data_for_timerange(start_time, end_time, selected_tags, level, progress, cancelled, layout,
+                                             pin='plot')
+        
+        def draw():
+            self.on_load_done()
+            self.perf.current = frame
+            try:
+                self.draw_plot(start_time, end_time, selected_tags, level, num_buckets, layout)
+            finally:
+                self.cache.unpin('plot')
+                self.perf.finish(frame)
+            self.show_perf_stats()
+            self.prefetch_adjacent(start_time, end_time, selected_tags, num_buckets)
+        
+        self.loader.cancel('prefetch')
+        self.loader.submit('plot', load, draw)
+    
+    def prefetch_adjacent(self, start_time, end_time, selected_tags, num_buckets):
+        """在后台预读当前范围左右相邻的两个同样长度的窗口，平移时可以直接从缓存绘图"""
+        span = end_time - start_time
+        windows = []
+        for s, e in ((end_time, end_time + span), (start_time - span, start_time)):
+            level = self.choose_rollup_level(s, e, num_buckets)
+            layout = self.choose_raw_layout(s, e, selected_tags) if level is None else 'matrix'
+            windows.append((s, e, level, layout))
+        
+        def load(progress, cancelled):
+            for s, e, level, layout in windows:
+                if cancelled():
+                    raise LoadCancelled()
+                self.load_data_for_timerange(s, e, selected_tags, level, cancelled=cancelled, layout=layout)
+        
+        self.loader.submit('prefetch', load, lambda: None)
+    
+    def set_time_window(self, start_time, end_time):
+        """把新的可见范围写入时间输入框并立即移动已有的曲线，停止操作一段时间后再加载数据"""
+        self.start_time_edit.setDateTime(QDateTime(pd.Timestamp(start_time).round('s').to_pydatetime()))
+        self.end_time_edit.setDateTime(QDateTime(pd.Timestamp(end_time).round('s').to_pydatetime()))
+        self.plot_axes[0][0].set_xlim(start_time, end_time)
+        self.canvas.draw_idle()
+        self.navigate_timer.start()
+    
+    def on_scroll(self, event):
+        """滚轮以鼠标所在时间为中心缩放时间轴，向上滚放大"""
+        if not event.inaxes or event.xdata is None or not self.plot_axes:
+            return
+        start_time = pd.Timestamp(self.start_time_edit.dateTime().toPyDateTime())
+        end_time = pd.Timestamp(self.end_time_edit.dateTime().toPyDateTime())
+        center = pd.Timestamp(event.xdata, unit='D')
+        factor = 1 / ZOOM_STEP if event.button == 'up' else ZOOM_STEP
+        old_span = end_time - start_time
+        span = max(old_span * factor, pd.Timedelta(seconds=MIN_WINDOW_SECONDS))
+        # 鼠标所在时间在新范围中的相对位置不变；起止时间相同或颠倒时以鼠标所在时间为中心
+        ratio = (center - start_time) / old_span if old_span > pd.Timedelta(0) else 0.5
+        new_start = center - span * ratio
+        self.set_time_window(new_start, new_start + span)
+    
+    def on_pan_press(self, event):
+        """左键按下时记录拖动起点和当时的时间范围"""
+        if event.button == 1 and event.inaxes and self.plot_axes:
+            self.pan_origin = (event.x,
+                               pd.Timestamp(self.start_time_edit.dateTime().toPyDateTime()),
+                               pd.Timestamp(self.end_time_edit.dateTime().toPyDateTime()))
+    
+    def on_pan_release(self, event):
+        if event.button == 1:
+            self.pan_origin = None
+    
+    def pan_to(self, event):
+        """按拖动的像素距离平移时间范围"""
+        x0, start_time, end_time = self.pan_origin
+        shift = (end_time - start_time) * ((x0 - event.x) / self.plot_axes[0][0].bbox.width)
+        self.set_time_window(start_time + shift, end_time + shift)
+    
+    def draw_plot(self, start_time, end_time, selected_tags, level, num_buckets, layout='matrix'):
+        """用已加载的数据绘图
+
+        坐标轴按位置复用：第i个选中的tag画在第i个坐标轴上，已有的曲线只用set_data更新数据，
+        只在tag数量变化时增删twinx坐标轴；坐标轴数量和画布大小都没变时不再调用tight_layout
+        """
+        self.clear_overlay()
+        self.cursor_series = []
+        pixel_ns = (pd.Timestamp(end_time) - pd.Timestamp(start_time)).value // num_buckets
+        self.cursor_tolerance_ns = max(CURSOR_TOLERANCE_SECONDS * 10**9, pixel_ns)
+        
+        # 增删坐标轴，使数量与选中的tag一致（第一个坐标轴始终保留）
+        with self.perf.timer('plot'):
+            while len(self.plot_axes) > max(len(selected_tags), 1):
+                self.plot_axes.pop()[0].remove()
+            while len(self.plot_axes) < len(selected_tags):
+                self.add_plot_axis()
         
         # 用于存储每个曲线的颜色
         colors = plt.cm.tab20(np.linspace(0, 1, len(selected_tags)))
         
-        # 绘制每个选中的数据点
-        for i, (tag_name, color) in enumerate(zip(selected_tags, colors)):
-            # 滤数
-            mask = (self.df.index >= start_time) & (self.df.index <= end_time)
-            data = self.df.loc[mask, (tag_name, 'value')]
-            quality = self.df.loc[mask, (tag_name, 'quality')]
-            
-            # 区分正常数据和异常数据
-            good_quality_mask = quality == 0
-            bad_quality_mask = quality != 0
-            
-            # 创建新的y轴
-            if i == 0:
-                curr_ax = ax
-            else:
-                curr_ax = ax.twinx()
-                # 对第3个及后的轴进行偏移
-                if i >= 2:
-                    offset = (i-1) * 60  # 每个轴偏移60像素
-                    curr_ax.spines['right'].set_position(('outward', offset))
-            
-            # 隐藏y轴刻度标签
-            curr_ax.yaxis.set_ticks([])
-            curr_ax.yaxis.set_ticklabels([])
+        # 更新每个选中的数据点的曲线
+        for (curr_ax, good_line, bad_line), tag_name, color in zip(self.plot_axes, selected_tags, colors):
+            # 取时间范围内的数据
+            good_times, good_data, bad_times, bad_data, steps = self.get_plot_data(
+                tag_name, start_time, end_time, level, num_buckets, layout)
             
-            # 隐藏y轴线
-            curr_ax.spines['right'].set_visible(False)
-            if i == 0:
-                curr_ax.spines['left'].set_visible(False)
+            # 按死区记录的变化点与原始值最多相差死区，在游标读数和标注的tag名后注明
+            deadband = self.sparse_store.deadband(tag_name, self.store.months_between(start_time, end_time)) \
+                if steps is not None else 0.0
+            label = f"{tag_name}(±{deadband:g})" if deadband > 0 else tag_name
             
-            # 绘制正常数据点
-            if good_quality_mask.any():
-                line = curr_ax.plot(data.index[good_quality_mask], 
-                                  data[good_quality_mask], 
-                                  '-', linewidth=1.5, color=color)[0]
-                line.set_gid(tag_name)  # 使用gid存储标签信息
-            
-            # 绘制异常数据点
-            if bad_quality_mask.any():
-                line = curr_ax.plot(data.index[bad_quality_mask], 
-                                  data[bad_quality_mask], 
-                                  'x', color=color, alpha=0.5)[0]
-                line.set_gid(tag_name)  # 使用gid存储标签信息
-            
-            # 设置Y轴范围
-            if tag_name in self.range_controls:
-                min_edit, max_edit = self.range_controls[tag_name]
-                try:
-                    y_min = float(min_edit.text())
-                    y_max = float(max_edit.text())
-                    curr_ax.set_ylim(y_min, y_max)
-                except ValueError:
-                    pass
-        
-        # 设置网格
-        ax.grid(True, color='#404040', linestyle='-', linewidth=0.5)
-        
-        # 设置x轴样式
-        ax.tick_params(axis='x', colors='#ffffff')
-        
-        # 调整布局
-        self.figure.tight_layout()
-        self.canvas.draw()
+            # 正常数据点和异常数据点
+            with self.perf.timer('plot'):
+                for line, times, data in ((good_line, good_times, good_data), (bad_line, bad_times, bad_data)):
+                    line.set_data(times, data)
+                    line.set_color(color)
+                    line.set_gid(label)  # 使用gid存储标签信息
+                    if steps is None and len(times):
+                        self.cursor_series.append((curr_ax, line, times.astype('datetime64[ns]').view('int64'), data, None))
+                if steps is not None:
+                    # 阶梯曲线按变化点查找游标时刻生效的值，正常值和异常值分别归到各自的曲线
+                    step_times, step_data, step_quality, end_point = steps
+                    index_ns = step_times.astype('datetime64[ns]').view('int64')
+                    end_ns = int(np.datetime64(end_point, 'ns').view('int64'))
+                    for line, mask in ((good_line, step_quality == 0), (bad_line, step_quality != 0)):
+                        if mask.any():
+                            self.cursor_series.append((curr_ax, line, index_ns, np.where(mask, step_data, np.nan), end_ns))
+                self.perf.count('points', len(good_times) + len(bad_times))
+                
+                # 设置Y轴范围
+                self.apply_y_range(curr_ax, tag_name)
+        
+        self.plot_axes[0][0].set_xlim(start_time, end_time)
+        self.drawn_request = (start_time, end_time, tuple(selected_tags), level, num_buckets)
+        
+        # 坐标轴数量或画布大小变化时才重新调整布局
+        layout_key = (len(self.plot_axes), tuple(self.figure.get_size_inches()))
+        if layout_key != self.plot_layout_key:
+            with self.perf.timer('tight_layout'):
+                self.figure.tight_layout()
+            self.plot_layout_key = layout_key
+        with self.perf.timer('draw'):
+            self.canvas.draw()
+    
+    def on_perf_toggled(self, checked):
+        self.perf_label.setVisible(checked)
+        self.show_perf_stats()
+    
+    def show_perf_stats(self):
+        """在图表下方显示最近一帧各步骤的耗时、数据行数、绘制的点数和缓存命中率"""
+        frame = self.perf.last
+        if not self.perf_checkbox.isChecked() or frame is None:
+            return
+        steps = "  ".join(f"{name} {frame.seconds[step] * 1000:.1f}ms" for step, name in PERF_STEPS)
+        frame_rate = frame.cache_hit_rate()
+        frame_rate = f"{frame_rate:.0%}" if frame_rate is not None else "-"
+        self.perf_label.setText(
+            f"{frame.info['tags']}个tag  {frame.info['span']}  {frame.info['level']}/{frame.info['layout']}\n"
+            f"{steps}  合计 {frame.total * 1000:.1f}ms\n"
+            f"行数 {frame.counts['rows']:,}  点数 {frame.counts['points']:,}  "
+            f"缓存命中 本帧 {frame_rate} 累计 {self.cache.hit_rate():.0%}  "
+            f"已用 {self.cache.size_bytes / 1024 / 1024:.0f}/{self.cache.budget_bytes / 1024 / 1024:.0f} MB")
+    
+    def add_plot_axis(self):
+        """新建一个坐标轴和它的正常点、异常点两条曲线，第2个起为共享x轴的twinx"""
+        i = len(self.plot_axes)
+        if i == 0:
+            curr_ax = self.figure.add_subplot(111)
+            # 设置网格
+            curr_ax.grid(True, color='#404040', linestyle='-', linewidth=0.5)
+            # 设置x轴样式
+            curr_ax.tick_params(axis='x', colors='#ffffff')
+            curr_ax.spines['left'].set_visible(False)
+        else:
+            curr_ax = self.plot_axes[0][0].twinx()
+            # 对第3个及后的轴进行偏移
+            if i >= 2:
+                offset = (i-1) * 60  # 每个轴偏移60像素
+                curr_ax.spines['right'].set_position(('outward', offset))
+        
+        # 隐藏y轴刻度标签
+        curr_ax.yaxis.set_ticks([])
+        curr_ax.yaxis.set_ticklabels([])
+        
+        # 隐藏y轴线
+        curr_ax.spines['right'].set_visible(False)
+        
+        good_line = curr_ax.plot([], [], '-', linewidth=1.5)[0]
+        bad_line = curr_ax.plot([], [], 'x', alpha=0.5)[0]
+        self.plot_axes.append((curr_ax, good_line, bad_line))
+    
+    def apply_y_range(self, curr_ax, tag_name):
+        """使用范围控制器中的Y轴范围，没有填写有效范围时按数据自动缩放"""
+        if tag_name in self.range_controls:
+            min_edit, max_edit = self.range_controls[tag_name]
+            try:
+                y_min = float(min_edit.text())
+                y_max = float(max_edit.text())
+                curr_ax.set_ylim(y_min, y_max)
+                return
+            except ValueError:
+                pass
+        curr_ax.set_autoscaley_on(True)
+        curr_ax.relim()
+        curr_ax.autoscale_view(scalex=False)
     
     def save_screenshot(self):
         """保存当前图表截图"""
@@ -453,11 +1579,9 @@ class DataViewer(QMainWindow):
     
     def reset_selection(self):
         """清除所有选中的数据"""
-        iterator = QTreeWidgetItemIterator(self.tag_tree)
-        while iterator.value():
-            item = iterator.value()
-            item.setSelected(False)
-            iterator += 1
+        self.selected_tag_set.clear()
+        self.sync_tree_selection()
+        self.on_selection_changed()
         self.update_plot()
     
     def create_range_controls(self, selected_tags):
@@ -478,6 +1602,7 @@ class DataViewer(QMainWindow):
         self.range_controls.clear()
         
         # 为每个选中的数据点创建范围控制器
+        new_tags = []
         for i, tag in enumerate(selected_tags):
             # 创建框
             group = QWidget()
@@ -513,18 +1638,14 @@ class DataViewer(QMainWindow):
             min_edit.setFixedWidth(60)
             max_edit.setFixedWidth(60)
             
-            # 如果有保存的范围值就使用它，否则使用默认值
-            if tag in current_ranges:
+            # 如果有保存的范围值就使用它，否则在后台加载数据后填入默认值
+            # （之前还没等到默认值的tag一起重新请求，旧的请求已被取消）
+            if tag in current_ranges and any(current_ranges[tag]):
                 min_val, max_val = current_ranges[tag]
                 min_edit.setText(min_val)
                 max_edit.setText(max_val)
             else:
-                # 设置默认值
-                data = self.df[tag]['value']
-                min_val = data.min()
-                max_val = data.max()
-                min_edit.setText(f"{min_val:.2f}")
-                max_edit.setText(f"{max_val:.2f}")
+                new_tags.append(tag)
             
             # 添加到布局
             range_layout.addWidget(min_label)
@@ -548,67 +1669,172 @@ class DataViewer(QMainWindow):
             
             # 不再直接连接信号到update_plot
             # 范围的更新将通过"更新图表"按钮触发
+        
+        if new_tags:
+            self.load_range_defaults(new_tags)
+    
+    def load_range_defaults(self, tags):
+        """把默认范围填入仍为空的范围输入框
 
+        优先使用入库时生成的月度统计文件，直接查表；没有统计文件的tag在后台加载当前时间范围内的数据，
+        完成后填入最小最大值
+        """
+        start_time = self.start_time_edit.dateTime().toPyDateTime()
+        end_time = self.end_time_edit.dateTime().toPyDateTime()
+        
+        mode = RANGE_MODES[self.range_mode_combo.currentIndex()]
+        ranges = self.stats.get_ranges(tags, self.store.months_between(start_time, end_time), mode)
+        for tag, (min_val, max_val) in ranges.items():
+            min_edit, max_edit = self.range_controls[tag]
+            if not min_edit.text() and not max_edit.text():
+                min_edit.setText(f"{min_val:.2f}")
+                max_edit.setText(f"{max_val:.2f}")
+        tags = [tag for tag in tags if tag not in ranges]
+        if not tags:
+            return
+        
+        # 与绘图请求相同，加载完的数据在填入范围之前固定在缓存中，不会被排在后面的绘图请求淘汰
+        def load(progress, cancelled):
+            self.cache.unpin('ranges')
+            self.load_data_for_timerange(start_time, end_time, tags, None, progress, cancelled, pin='ranges')
+        
+        def fill():
+            self.on_load_done()
+            try:
+                for tag in tags:
+                    if tag not in self.range_controls:
+                        continue
+                    min_edit, max_edit = self.range_controls[tag]
+                    if min_edit.text() or max_edit.text():
+                        continue
+                    _, data, _, _ = self.get_raw_series(tag, start_time, end_time)
+                    min_val = np.nanmin(data) if len(data) else np.nan
+                    max_val = np.nanmax(data) if len(data) else np.nan
+                    min_edit.setText(f"{min_val:.2f}")
+                    max_edit.setText(f"{max_val:.2f}")
+            finally:
+                self.cache.unpin('ranges')
+        
+        self.loader.submit('ranges', load, fill)
+
+    def on_range_mode_changed(self):
+        """切换默认范围的取法后，清空并重新填写所有范围输入框"""
+        for min_edit, max_edit in self.range_controls.values():
+            min_edit.clear()
+            max_edit.clear()
+        if self.range_controls:
+            self.load_range_defaults(list(self.range_controls))
+    
     def on_selection_changed(self):
         """当树控件的选择发生变化时调用"""
         selected_tags = self.get_selected_tags()
         self.create_range_controls(selected_tags)
     
+    def query_cursor(self, t_ns):
+        """返回每条曲线在t_ns处的点 [(ax, line, 时间纳秒, 数值)]，每条曲线一次二分查找
+
+        采样曲线取离t_ns最近且在容差内的点；阶梯曲线只存变化点，取t_ns时生效的值（之前最后一个变化点），
+        时间即t_ns，超出终点时间或生效的值属于另一条曲线时不返回
+        """
+        points = []
+        for ax, line, index_ns, values, end_ns in self.cursor_series:
+            if end_ns is None:
+                idx = nearest_sample(index_ns, t_ns)
+                if idx >= 0 and abs(int(index_ns[idx]) - t_ns) <= self.cursor_tolerance_ns:
+                    points.append((ax, line, int(index_ns[idx]), values[idx]))
+            else:
+                idx = int(np.searchsorted(index_ns, t_ns, side='right')) - 1
+                if idx >= 0 and t_ns <= end_ns and not np.isnan(values[idx]):
+                    points.append((ax, line, t_ns, values[idx]))
+        return points
+    
+    def clear_overlay(self):
+        """移除游标线和标注，重新绘图前调用"""
+        for artist in [self.vline, self.hover_line] + self.data_annotations:
+            if artist is not None:
+                artist.remove()
+        self.vline = None
+        self.hover_line = None
+        self.data_annotations = []
+    
+    def on_canvas_draw(self, event):
+        """整图重绘后缓存不含覆盖层的背景，再把游标线和标注画在上面"""
+        self.plot_background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.draw_overlay()
+    
+    def draw_overlay(self):
+        for artist in [self.vline, self.hover_line] + self.data_annotations:
+            if artist is not None and artist.get_visible():
+                self.figure.draw_artist(artist)
+    
+    def blit_overlay(self):
+        """只重画游标线和标注：恢复缓存的背景，画覆盖层后blit，不重新渲染曲线"""
+        if self.plot_background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.plot_background)
+        self.draw_overlay()
+        self.canvas.blit(self.figure.bbox)
+    
+    def on_mouse_move(self, event):
+        """鼠标移动时游标线跟随鼠标，并在状态栏显示游标时间和各曲线最近点的数值；拖动时平移"""
+        if self.pan_origin is not None:
+            self.pan_to(event)
+            return
+        if not self.cursor_series:
+            return
+        if not event.inaxes or event.xdata is None:
+            if self.hover_line is not None and self.hover_line.get_visible():
+                self.hover_line.set_visible(False)
+                self.blit_overlay()
+            return
+        if self.hover_line is None:
+            self.hover_line = self.plot_axes[0][0].axvline(event.xdata, linestyle=':', color='white',
+                                                           alpha=0.3, animated=True)
+        self.hover_line.set_xdata([event.xdata, event.xdata])
+        self.hover_line.set_visible(True)
+        self.blit_overlay()
+        
+        cursor_time = pd.Timestamp(event.xdata, unit='D')
+        readout = [f"{line.get_gid()}={y:.2f}" for _, line, _, y in self.query_cursor(cursor_time.value)]
+        self.statusBar().showMessage(f"{cursor_time.strftime('%Y-%m-%d %H:%M:%S')}  " + "  ".join(readout))
+    
     def on_mouse_click(self, event):
         """处理鼠标点击事件"""
         if event.button == 3 and event.inaxes:  # 鼠标右键
-            # 清除之前的垂直线和标注
-            if self.vline:
-                self.vline.remove()
+            # 清除之前的标注
             for ann in self.data_annotations:
                 ann.remove()
             self.data_annotations = []
             
-            # 绘制新的垂直线
-            ymin, ymax = event.inaxes.get_ylim()
-            self.vline = event.inaxes.plot([event.xdata, event.xdata], 
-                                          [ymin, ymax], 
-                                          '--', 
-                                          color='white', 
-                                          alpha=0.5)[0]
+            # 移动垂直线，第一次点击时创建
+            if self.vline is None:
+                self.vline = self.plot_axes[0][0].axvline(event.xdata, linestyle='--', color='white',
+                                                          alpha=0.5, animated=True)
+            self.vline.set_xdata([event.xdata, event.xdata])
             
             # 获取点击时间
             click_time = pd.Timestamp(event.xdata, unit='D')
             
-            # 获取当前显示的所有曲线
-            for ax in self.figure.axes:
-                for line in ax.lines:
-                    if line.get_gid() is not None:  # 检查是否有标签信息
-                        # 找到最接近点击位置的数点
-                        xdata = line.get_xdata()
-                        ydata = line.get_ydata()
-                        
-                        # 将时间换为数值类型
-                        xdata_num = np.array([pd.Timestamp(x).timestamp() for x in xdata])
-                        
-                        # 找到最接近的时间点
-                        idx = np.abs(xdata_num - click_time.timestamp()).argmin()
-                        x = xdata[idx]
-                        y = ydata[idx]
-                        
-                        # 检查时间差是否在20秒内
-                        time_diff = abs(pd.Timestamp(x) - click_time).total_seconds()
-                        if time_diff <= 20:  # 只有在20秒内的点才显示标注
-                            # 创建数据点标注
-                            timestamp = pd.Timestamp(x).strftime('%Y-%m-%d %H:%M:%S')
-                            annotation = ax.annotate(
-                                f'{line.get_gid()}\n{y:.2f}\n{timestamp}',
-                                xy=(x, y),
-                                xytext=(10, 10),
-                                textcoords='offset points',
-                                bbox=dict(boxstyle='round,pad=0.5', fc='#363636', ec='#555555', alpha=0.8),
-                                color=line.get_color(),
-                                fontsize=8
-                            )
-                            self.data_annotations.append(annotation)
+            # 在每条曲线的时间索引中二分查找最接近点击位置的数据点，只有在容差内的点才显示标注
+            for ax, line, t_ns, y in self.query_cursor(click_time.value):
+                x = pd.Timestamp(t_ns)
+                # 创建数据点标注
+                timestamp = x.strftime('%Y-%m-%d %H:%M:%S')
+                annotation = ax.annotate(
+                    f'{line.get_gid()}\n{y:.2f}\n{timestamp}',
+                    xy=(x, y),
+                    xytext=(10, 10),
+                    textcoords='offset points',
+                    bbox=dict(boxstyle='round,pad=0.5', fc='#363636', ec='#555555', alpha=0.8),
+                    color=line.get_color(),
+                    fontsize=8,
+                    animated=True
+                )
+                self.data_annotations.append(annotation)
             
-            # 更新图表
-            self.canvas.draw()
+            # 只重画覆盖层
+            self.blit_overlay()
     
     def adjust_time(self, time_edit, direction):
         """调整时间
@@ -622,49 +1848,21 @@ class DataViewer(QMainWindow):
         time_edit.setDateTime(adjusted_time)
     
     def filter_tags(self, text):
-        """根据搜索文本过滤标签，支持*作为通配符"""
-        # 将搜索文本转换为正则表达式模式
+        """根据搜索文本过滤标签，支持*和?通配符"""
+        # 被过滤掉的行会触发取消选中的信号，这时不更新selected_tag_set
+        self.syncing_selection = True
+        try:
+            self.tag_proxy.set_visible_tags(self.tag_index.search(text))
+        finally:
+            self.syncing_selection = False
+        # 过滤后重新选中仍然可见的已选tag
+        self.sync_tree_selection()
+        
+        # 有搜索文本时展开可见的组，搜索框为空时折叠所有组
         if text:
-            # 将*替换为正则表���式的.*，并对其他特殊字符进行转义
-            import re
-            pattern = text.lower()
-            # 转义正则表达式特殊字符，但保留*号
-            pattern = ''.join(['.' if c == '*' else re.escape(c) for c in pattern])
-            try:
-                regex = re.compile(pattern)
-            except re.error:
-                # 如果正则表达式无效，则进行普通文本匹配
-                regex = None
-        
-        # 遍历所有项目
-        root = self.tag_tree.invisibleRootItem()
-        for i in range(root.childCount()):
-            group_item = root.child(i)
-            group_visible = False
-            
-            # 检每个子项
-            for j in range(group_item.childCount()):
-                child_item = group_item.child(j)
-                child_text = child_item.text(0).lower()
-                
-                # 如果搜索文本为空或者文本匹配，则显示项目
-                if not text:
-                    should_show = True
-                elif regex:
-                    should_show = bool(regex.search(child_text))
-                else:
-                    # 降级为简单的文本包含匹配
-                    should_show = text.lower() in child_text
-                    
-                child_item.setHidden(not should_show)
-                group_visible = group_visible or should_show
-            
-            # 如果组内有可见项目，则显示组并展开
-            group_item.setHidden(not group_visible)
-            if group_visible and text:  # 只在有搜索文本且组可见时展开
-                group_item.setExpanded(True)
-            elif not text:  # 当搜索框为空时折叠所有组
-                group_item.setExpanded(False)
+            self.tag_tree.expandAll()
+        else:
+            self.tag_tree.collapseAll()
 
     def save_config(self):
         """保存当前配置到文件"""
@@ -744,12 +1942,7 @@ class DataViewer(QMainWindow):
             tags = config['Tags']['tag_list'].split(',')
             
             # 选中这些标签
-            iterator = QTreeWidgetItemIterator(self.tag_tree)
-            while iterator.value():
-                item = iterator.value()
-                if item.childCount() == 0 and item.text(0) in tags:
-                    item.setSelected(True)
-                iterator += 1
+            self.select_tags(tags)
         
         def set_ranges():
             # 设置范围值
@@ -775,9 +1968,20 @@ class DataViewer(QMainWindow):
         
         # 使用定时器延迟设置范围值
         QTimer.singleShot(100, set_ranges)
+    
+    def closeEvent(self, event):
+        """关闭窗口时取消后台加载"""
+        self.loader.shutdown()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    viewer = DataViewer()
+    import argparse
+    parser = argparse.ArgumentParser(description="数据查看器")
+    parser.add_argument('--cache-mb', type=int, default=CACHE_BUDGET_MB, help="数据缓存的内存预算(MB)")
+    parser.add_argument('--perf-log', default=PERF_LOG_FILE, help="每帧耗时的日志文件，为空时不记录")
+    args, qt_args = parser.parse_known_args()
+    
+    app = QApplication(sys.argv[:1] + qt_args)
+    viewer = DataViewer(cache_budget_mb=args.cache_mb, perf_log=args.perf_log)
     viewer.show()
     sys.exit(app.exec()) 
\ No newline at end of file
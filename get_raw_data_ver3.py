@@ -2,89 +2,1141 @@
 # 在根目录下按照yyyymmdd格式，每天一个文件夹，每个文件夹里有近5800个raw文件
 # 目前已产生近100个工作日的存档文件夹，后面会增加到1000个文件夹
 # 每个raw文件能输出1314对数据和质量码，数据用float格式储存，质量码用int格式储存
+# 增量模式下用ingest_manifest.json记录已入库的文件夹和文件(mtime/size)，只处理新增或修改过的文件
+# 每个月还会生成1min/10min/1h的汇总文件(rollup_<层级>_YYYYMM.parquet)，供查看器显示长时间范围
+# 以及每个tag的整月统计文件(stats_YYYYMM.parquet)，供查看器直接填写默认的Y轴范围
+# 可选的变化存储(--sparse): 每个tag只在数值变化超过死区或质量码变化时记一行，写成sparse_YYYYMM.parquet，
+# 按tag、时间排序，适合长时间保持不变的tag（棒位、开关量等），查看器读出后还原成阶梯曲线
+# 可选的按前缀分区存储(--prefix-store): 每个月按tag前缀拆成多个窄文件 by_prefix/data_<前缀>_YYYYMM.parquet，
+# 查看器查少数几个tag的长时间范围时读这些文件，按需要读取的字节数在两种存储之间选择
+# tag_catalog.json记录所有tag(前缀、首次/最后出现的月份、数据类型)和各月的时间范围，查看器启动时只读这个文件
+# 每次入库在ingest_report.json中记录各批次和各月的耗时，以及按文件、tag、错误类型汇总的解析错误
 # 
 import os
+import ast
+import json
+import time
+import warnings
+import argparse
 import pyarrow as pa
 import pyarrow.parquet as pq
 from datetime import datetime
 import logging
-from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import multiprocessing as mp
 import numpy as np
 from tqdm import tqdm
 import pandas as pd
 
-def parse_raw_file(file_path):
-    """解析单个raw文件并返回数据"""
+ERROR_EXAMPLES = 5  # 每种错误保留的示例数量
+RUN_REPORT_FILE = 'ingest_report.json'  # 最近一次入库的运行报告，与月度文件放在一起
+
+class IngestMetrics:
+    """入库过程中的错误计数和各批次的耗时
+
+    工作进程中每批一个实例，只累加计数，不逐行写日志；批次结果带回主进程后用merge合并。
+    错误按类型、文件、tag三个维度计数，每种类型保留前几条示例便于定位。
+    错误类型: bad_filename(文件名中没有时间戳)、read_error(文件无法读取)、short_file(不足3行表头)、
+    short_line(不足4列)、bad_value(数据或质量码无法转换)、unknown_tag(不在tag列表中)
+    """
+    def __init__(self):
+        self.by_type = Counter()
+        self.by_file = {}
+        self.by_tag = {}
+        self.examples = {}
+        self.batches = []
+    
+    @property
+    def total(self):
+        return sum(self.by_type.values())
+    
+    def error(self, kind, file_name, tag=None, example=None):
+        self.by_type[kind] += 1
+        self.by_file.setdefault(file_name, Counter())[kind] += 1
+        if tag is not None:
+            self.by_tag.setdefault(tag, Counter())[kind] += 1
+        if example is not None:
+            examples = self.examples.setdefault(kind, [])
+            if len(examples) < ERROR_EXAMPLES:
+                examples.append(f"{file_name}: {example}")
+    
+    def merge(self, other):
+        self.by_type.update(other.by_type)
+        for target, source in ((self.by_file, other.by_file), (self.by_tag, other.by_tag)):
+            for key, counts in source.items():
+                target.setdefault(key, Counter()).update(counts)
+        for kind, examples in other.examples.items():
+            target = self.examples.setdefault(kind, [])
+            target.extend(examples[:ERROR_EXAMPLES - len(target)])
+        self.batches.extend(other.batches)
+    
+    def summary(self):
+        return ', '.join(f"{kind} {count}" for kind, count in self.by_type.most_common())
+    
+    def to_dict(self):
+        """错误部分，按出错次数从多到少排列"""
+        def ordered(groups):
+            return {key: dict(counts) for key, counts in
+                    sorted(groups.items(), key=lambda item: -sum(item[1].values()))}
+        return {'total': self.total, 'by_type': dict(self.by_type.most_common()),
+                'by_file': ordered(self.by_file), 'by_tag': ordered(self.by_tag), 'examples': self.examples}
+
+def parse_raw_file(file_path, metrics=None):
+    """解析单个raw文件并返回数据
+
+    无法解析的行跳过，计入metrics而不逐行写日志；metrics为None时每个文件最多写一条汇总的警告
+    """
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = IngestMetrics()
+    filename = os.path.basename(file_path)
     try:
-        with open(file_path, 'r') as f:
-            filename = os.path.basename(file_path)
+        try:
             timestamp = datetime.strptime(filename.split('_')[1].split('.')[0], '%Y%m%d%H%M%S')
-            
+        except (IndexError, ValueError) as e:
+            metrics.error('bad_filename', filename, example=str(e))
+            return
+        
+        with open(file_path, 'r') as f:
             # 跳过前3行
-            for _ in range(3):
-                next(f)
+            header = [f.readline() for _ in range(RAW_HEADER_LINES)]
+            if not header[-1]:
+                metrics.error('short_file', filename)
+                return
             
-            for line_num, line in enumerate(f, start=4):  # 从第4行开始计数
+            for line_num, line in enumerate(f, start=RAW_HEADER_LINES + 1):
                 line = line.strip()
-                if not line or line in ['Dx', 'Ax']:
+                if not line or line in SECTION_MARKERS:
+                    continue
+                
+                parts = line.split()
+                if len(parts) < 4:
+                    metrics.error('short_line', filename, parts[1] if len(parts) > 1 else None,
+                                  f"第 {line_num} 行: '{line}'")
                     continue
-                    
                 try:
-                    parts = line.split()
-                    if len(parts) >= 4:
-                        try:
-                            # 数据用float格式，质量码用int格式
-                            value = float(parts[2])
-                            quality = int(parts[3])
-                            yield timestamp, parts[1], value, quality
-                        except ValueError:
-                            logging.warning(f"无法转换数值: {parts[2]} 在文件 {filename} 第 {line_num} 行: '{line}'")
-                            continue
-                except (ValueError, IndexError) as e:
-                    logging.warning(f"文件 {filename} 第 {line_num} 行解析失败: '{line}' - 错误: {str(e)}")
+                    # 数据用float格式，质量码用int格式
+                    value = float(parts[2])
+                    quality = int(parts[3])
+                except ValueError:
+                    metrics.error('bad_value', filename, parts[1], f"第 {line_num} 行: '{line}'")
                     continue
-    except Exception as e:
-        logging.error(f"处理文件出错 {file_path}: {str(e)}")
+                yield timestamp, parts[1], value, quality
+    except (OSError, ValueError) as e:
+        metrics.error('read_error', filename, example=str(e))
+    finally:
+        if own_metrics and metrics.total:
+            logging.warning(f"文件 {filename} 中有 {metrics.total} 处错误: {metrics.summary()}")
+
+RAW_HEADER_LINES = 3
+SECTION_MARKERS = ('Dx', 'Ax')
+
+def parse_raw_file_bulk(file_path, metrics=None):
+    """一次读入整个raw文件，批量解析tag、数据和质量码
+
+    正常文件除了3行表头和Dx/Ax分段标记外每行都是4列：先整体去掉分段标记，
+    一次切分出全部字段，用line_field_counts确认每个非空行都是4列后，再按4列步长取出tag、数据和质量码列整体转换。
+    行格式不规则或有无法转换的数值时退回逐行解析，由parse_raw_file记录出错的行。
+    返回 (timestamp, tags, values, qualities)，tags为tag名列表（保持文件中的顺序，
+    便于直接和tag_names比较），values为float64数组，qualities为int64数组；
+    文件无法读取时返回None。出错的文件和行计入metrics，metrics为None时每个文件最多写一条日志
+    """
+    filename = os.path.basename(file_path)
+    try:
+        timestamp = datetime.strptime(filename.split('_')[1].split('.')[0], '%Y%m%d%H%M%S')
+    except (IndexError, ValueError) as e:
+        record_file_error(metrics, 'bad_filename', file_path, str(e))
+        return None
+    try:
+        with open(file_path, 'r') as f:
+            text = f.read()
+    except (OSError, ValueError) as e:
+        record_file_error(metrics, 'read_error', file_path, str(e))
+        return None
+    
+    parts = text.split('\n', RAW_HEADER_LINES)
+    if len(parts) <= RAW_HEADER_LINES:
+        record_file_error(metrics, 'short_file', file_path)
+        return None
+    
+    # 去掉整行的分段标记后，每个非空行都应恰好切出4个字段；
+    # 按行检查字段数，避免一行少一列、另一行多一列时总数恰好对上而错位
+    body = '\n' + parts[RAW_HEADER_LINES]
+    for marker in SECTION_MARKERS:
+        body = body.replace(f'\n{marker}\n', '\n')
+    fields = body.split()
+    counts = line_field_counts(body)
+    
+    if len(fields) == counts.sum() and np.all((counts == 4) | (counts == 0)):
+        try:
+            values = np.array(fields[2::4], dtype=np.float64)
+            qualities = np.array(fields[3::4], dtype=np.int64)
+            return timestamp, fields[1::4], values, qualities
+        except ValueError:
+            pass
+    
+    # 格式不规则，逐行解析并记录出错的行
+    rows = list(parse_raw_file(file_path, metrics))
+    tags = [row[1] for row in rows]
+    values = np.array([row[2] for row in rows], dtype=np.float64)
+    qualities = np.array([row[3] for row in rows], dtype=np.int64)
+    return timestamp, tags, values, qualities
+
+def line_field_counts(text):
+    """每行以空白分隔的字段数，用numpy在字节上统计字段的起点，不逐行切分
+
+    字节值不大于32的都当作空白，与str.split()对个别控制字符和Unicode空白的处理不同；
+    每行的计数为uint8，超过255会回绕。调用方应同时比较字段总数，不一致时按格式不规则处理
+    """
+    buf = np.frombuffer(b'\n' + text.encode() + b'\n', dtype=np.uint8)
+    blank = buf <= 32
+    # 字段的起点：前一个字节是空白、这个字节不是；按每个换行符分段求和，得到后面一行的字段数
+    starts = (blank[:-1] > blank[1:]).view(np.uint8)
+    return np.add.reduceat(starts, np.flatnonzero(buf[:-1] == ord('\n')))
+
+def record_file_error(metrics, kind, file_path, example=None):
+    """整个文件无法解析：计入metrics，没有metrics时写一条日志"""
+    if metrics is not None:
+        metrics.error(kind, os.path.basename(file_path), example=example)
+    else:
+        logging.error(f"处理文件出错 {file_path}: {kind} {example or ''}")
+
+VALUE_TYPE = 'float32'  # 月度文件数值列的存储类型，存成float32会损失精度的tag自动保留float64
+# raw文件中的数值一般保留3位小数，float32与原值的误差不超过最后一位的一半时仍能还原出文件中的数值
+FLOAT32_TOLERANCE = 5e-4
+# 质量码可选的整数类型，按从窄到宽的顺序；对应pandas的可空整数类型，缺失的质量码为空而不是0
+QUALITY_TYPES = [(pa.uint8(), 'UInt8'), (pa.int8(), 'Int8'), (pa.uint16(), 'UInt16'), (pa.int16(), 'Int16'),
+                 (pa.uint32(), 'UInt32'), (pa.int32(), 'Int32'), (pa.int64(), 'Int64')]
+
+def build_matrix_schema(tag_names, value_type='float64', quality_type=pa.int64(), float64_tags=()):
+    """按tag_names生成数据矩阵的Arrow schema
+
+    列顺序为每个tag的value、quality交替排列，索引列为timestamp；
+    schema中带有pandas元数据，pd.read_parquet读出来仍是(tag, type)多层列索引。
+    数值列为value_type（float64_tags中的tag总是float64），质量码为可空的quality_type。
+    默认的float64/int64用于临时文件，保留解析出的原始精度，合并成月度文件时再转换。
+    """
+    quality_dtype = dict((str(t), name) for t, name in QUALITY_TYPES)[str(quality_type)]
+    float64_tags = set(float64_tags)
+    columns = pd.MultiIndex.from_tuples(
+        [(tag, col_type) for tag in tag_names for col_type in ('value', 'quality')],
+        names=['tag', 'type']
+    )
+    empty_df = pd.DataFrame(
+        {col: pd.Series(dtype=(np.float64 if col[0] in float64_tags else value_type) if col[1] == 'value'
+                        else quality_dtype) for col in columns},
+        index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='timestamp')
+    )
+    empty_df.columns = columns
+    return pa.Schema.from_pandas(empty_df, preserve_index=True)
+
+class BatchAccumulator:
+    """一批文件的列式累加器
+
+    按tag_names建立固定的tag→列映射，预先分配 文件数×tag数 的数据矩阵和质量码矩阵，
+    每个时间戳占一行，解析结果整行写入；最后按时间排序直接生成Arrow表。
+    另外记录每个位置是否写入过，没有写入的质量码在表中为空。
+    """
+    def __init__(self, tag_names, capacity):
+        self.tag_names = list(tag_names)
+        self.tag_index = {tag: i for i, tag in enumerate(self.tag_names)}
+        num_tags = len(self.tag_names)
+        self.values = np.full((capacity, num_tags), np.nan, dtype=np.float64)
+        self.qualities = np.zeros((capacity, num_tags), dtype=np.int64)
+        self.present = np.zeros((capacity, num_tags), dtype=bool)
+        self.timestamps = np.empty(capacity, dtype='datetime64[ns]')
+        self.row_of = {}
+        self.num_rows = 0
+    
+    def add(self, timestamp, tags, values, qualities):
+        """写入一个文件的解析结果，同一时间戳的多个文件写入同一行，后写入的覆盖先写入的；
+        返回不在tag_names中、被忽略的tag"""
+        row = self.row_of.get(timestamp)
+        if row is None:
+            row = self.num_rows
+            self.num_rows += 1
+            self.row_of[timestamp] = row
+            self.timestamps[row] = np.datetime64(timestamp, 'ns')
+        
+        # 绝大多数文件的tag顺序与tag_names完全一致，可以整行写入
+        if tags == self.tag_names:
+            self.values[row] = values
+            self.qualities[row] = qualities
+            self.present[row] = True
+            return []
+        
+        cols = np.fromiter((self.tag_index.get(tag, -1) for tag in tags), dtype=np.intp, count=len(tags))
+        known = cols >= 0
+        self.values[row, cols[known]] = values[known]
+        self.qualities[row, cols[known]] = qualities[known]
+        self.present[row, cols[known]] = True
+        return [tag for tag, ok in zip(tags, known) if not ok]
+    
+    def to_table(self, schema):
+        """按时间排序后生成与schema一致的Arrow表"""
+        n = self.num_rows
+        timestamps = self.timestamps[:n]
+        values = self.values[:n]
+        qualities = self.qualities[:n]
+        present = self.present[:n]
+        order = np.argsort(timestamps, kind='stable')
+        if not (order == np.arange(n)).all():
+            timestamps, values, qualities, present = timestamps[order], values[order], qualities[order], present[order]
+        
+        arrays = []
+        for i in range(len(self.tag_names)):
+            arrays.append(pa.array(values[:, i]))
+            missing = ~present[:, i]
+            arrays.append(pa.array(qualities[:, i], mask=missing if missing.any() else None))
+        arrays.append(pa.array(timestamps))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+def float32_lossy_tags(table, tag_names, tolerance=FLOAT32_TOLERANCE):
+    """build_matrix_schema(tag_names)布局的表中，存成float32会损失精度的tag
+
+    float32还原的值与原值相差超过tolerance（包括超出float32范围）的tag需要保留float64；NaN不参与比较
+    """
+    lossy = []
+    with np.errstate(over='ignore', invalid='ignore'):
+        for i, tag in enumerate(tag_names):
+            values = table.column(2 * i).to_numpy()
+            if (np.abs(values.astype(np.float32).astype(np.float64) - values) > tolerance).any():
+                lossy.append(tag)
+    return lossy
 
 def process_file_batch(args):
-    """处理一批文件并写入临时parquet文件"""
-    file_batch, batch_id, tag_names = args
+    """处理一批文件并写入临时parquet文件，返回这一批的IngestMetrics（错误计数和耗时）
+
+    每个临时文件的元数据中记录存成float32会损失精度的tag，合并时这些tag的数值列保留float64
+    """
+    file_batch, batch_id, tag_names, float32_tolerance = args
+    metrics = IngestMetrics()
+    start = time.perf_counter()
     
-    # 使用字典存储数据和质量码
-    data_dict = {}
+    # 预分配的数据矩阵和质量码矩阵，缺失的数据为NaN，质量码为空
+    accumulator = BatchAccumulator(tag_names, len(file_batch))
     
+    num_parsed = 0
     for file_path in file_batch:
-        filename = os.path.basename(file_path)
-        for timestamp, tag, value, quality in parse_raw_file(file_path):
-            if timestamp not in data_dict:
-                data_dict[timestamp] = {}
-                for tag_name in tag_names:
-                    data_dict[timestamp][f'{tag_name}_value'] = np.nan
-                    data_dict[timestamp][f'{tag_name}_quality'] = 0
-            
-            data_dict[timestamp][f'{tag}_value'] = value
-            data_dict[timestamp][f'{tag}_quality'] = quality
+        parsed = parse_raw_file_bulk(file_path, metrics)
+        if parsed is None:
+            continue
+        num_parsed += 1
+        for tag in accumulator.add(*parsed):
+            metrics.error('unknown_tag', os.path.basename(file_path), tag)
+    parse_seconds = time.perf_counter() - start
+    
+    # 按月拆分后保存临时文件，每个文件内部已按时间排序，合并时按月做多路归并
+    table = accumulator.to_table(build_matrix_schema(tag_names))
+    for month_key, month_table in split_table_by_month(table):
+        lossy_tags = float32_lossy_tags(month_table, tag_names, float32_tolerance)
+        month_table = month_table.replace_schema_metadata(
+            {**month_table.schema.metadata, b'float64_tags': json.dumps(lossy_tags).encode()})
+        temp_path = os.path.join('temp_parquet', f'temp_batch_{batch_id}_{month_key}.parquet')
+        pq.write_table(month_table, temp_path)
+    
+    metrics.batches.append({'batch_id': batch_id, 'pid': os.getpid(), 'files': len(file_batch), 'parsed': num_parsed,
+                            'rows': table.num_rows, 'errors': metrics.total, 'parse_seconds': parse_seconds,
+                            'write_seconds': time.perf_counter() - start - parse_seconds})
+    return metrics
+
+def split_table_by_month(table):
+    """把按时间排序的表按月切片，返回 [(yyyymm, 子表)]"""
+    months = table.column('timestamp').to_numpy().astype('datetime64[M]')
+    if len(months) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    ends = np.r_[starts[1:], len(months)]
+    return [(str(months[start]).replace('-', ''), table.slice(start, end - start))
+            for start, end in zip(starts, ends)]
+
+def read_matrix_layout(parquet_file):
+    """从parquet的pandas元数据中读出索引列名和 {tag: {type: 列名}}（保持列顺序），不读取数据"""
+    pandas_meta = parquet_file.schema_arrow.pandas_metadata or {}
+    index_columns = [col for col in pandas_meta.get('index_columns', []) if isinstance(col, str)]
+    columns = {}
+    for col in pandas_meta.get('columns', []):
+        if col['field_name'] in index_columns:
+            continue
+        try:
+            tag, col_type = ast.literal_eval(col['name'])
+        except (ValueError, SyntaxError, TypeError):
+            continue
+        columns.setdefault(tag, {})[col_type] = col['field_name']
+    return (index_columns[0] if index_columns else None), columns
+
+def read_matrix_tags(parquet_file):
+    """从parquet的pandas元数据中读出tag列表（保持列顺序）和索引列名，不读取数据"""
+    index_column, columns = read_matrix_layout(parquet_file)
+    return list(columns), index_column
+
+def align_to_schema(table, schema, index_column):
+    """把来源表的列对齐到目标schema：索引列改名为timestamp，缺少的数值列补NaN、质量码列补空值，
+    类型不同的列转换类型"""
+    arrays = []
+    num_rows = table.num_rows
+    for field in schema:
+        name = index_column if field.name == 'timestamp' else field.name
+        if name in table.column_names:
+            column = table.column(name)
+            if column.type != field.type:
+                column = column.cast(field.type)
+            arrays.append(column)
+        elif pa.types.is_floating(field.type):
+            arrays.append(pa.array(np.full(num_rows, np.nan, dtype=field.type.to_pandas_dtype())))
+        else:
+            arrays.append(pa.nulls(num_rows, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def iter_sorted_chunks(path, schema, rows_per_chunk):
+    """按块读取一个已按时间排序的来源文件，每块对齐到目标schema"""
+    parquet_file = pq.ParquetFile(path)
+    _, index_column = read_matrix_tags(parquet_file)
+    index_column = index_column or '__index_level_0__'
+    for batch in parquet_file.iter_batches(batch_size=rows_per_chunk):
+        yield align_to_schema(pa.Table.from_batches([batch]), schema, index_column)
+
+def merge_month(sources, output_file, schema, memory_budget=None):
+    """把同一个月的多个按时间排序的来源文件做多路归并，逐个row group写出
     
-    # 转换为DataFrame
-    df = pd.DataFrame.from_dict(data_dict, orient='index')
+    sources按优先级从低到高排列，时间戳重复时保留优先级最高的来源的那一行。
+    每个来源每次只读入一块，块大小按内存预算和来源数量计算；每轮取各来源当前块
+    最后一个时间戳中最小的作为界限，界限之前的行一定已经全部读入，可以排序后写出。
+    输出文件按时间排序，每个row group最多ROW_GROUP_ROWS行，只为timestamp列写min/max统计，
+    查看器据此只读取与时间范围重叠的row group（tag列的统计对查询没有用，还会让文件尾部变大）。
+    先写到临时文件，成功后再替换output_file（output_file本身也可能是来源之一）。
+    """
+    memory_budget = memory_budget or MERGE_MEMORY_BUDGET
+    row_bytes = sum(field.type.bit_width // 8 for field in schema)
+    # 各来源的当前块、归并结果和待写出的缓冲各占一份
+    rows_per_chunk = max(64, memory_budget // (row_bytes * (len(sources) + 2)))
+    row_group_rows = min(ROW_GROUP_ROWS, rows_per_chunk)
     
-    # 创建多层列索引
+    iterators = [iter_sorted_chunks(path, schema, rows_per_chunk) for path in sources]
+    heads = [next(it, None) for it in iterators]
+    temp_output = output_file + '.tmp'
+    pending = []
+    pending_rows = 0
+    total_rows = 0
+    
+    try:
+        with pq.ParquetWriter(temp_output, schema, write_statistics=['timestamp']) as writer:
+            while True:
+                active = [i for i, head in enumerate(heads) if head is not None]
+                if not active:
+                    break
+                head_times = {i: heads[i].column('timestamp').to_numpy().view(np.int64) for i in active}
+                bound = min(times[-1] for times in head_times.values())
+                
+                pieces = []
+                priorities = []
+                for i in active:
+                    cut = int(np.searchsorted(head_times[i], bound, side='right'))
+                    pieces.append(heads[i].slice(0, cut))
+                    priorities.append(np.full(cut, i, dtype=np.int64))
+                    heads[i] = heads[i].slice(cut) if cut < heads[i].num_rows else next(iterators[i], None)
+                
+                merged = pa.concat_tables(pieces)
+                times = merged.column('timestamp').to_numpy().view(np.int64)
+                order = np.lexsort((np.concatenate(priorities), times))
+                times = times[order]
+                # 同一时间戳按来源优先级排序后只保留最后一行
+                keep = order[np.r_[times[1:] != times[:-1], True]]
+                merged = merged.take(pa.array(keep))
+                
+                pending.append(merged)
+                pending_rows += merged.num_rows
+                if pending_rows >= row_group_rows:
+                    # 只写出整的row group，剩下的行留到下一轮
+                    buffered = pa.concat_tables(pending)
+                    full_rows = pending_rows - pending_rows % row_group_rows
+                    writer.write_table(buffered.slice(0, full_rows), row_group_size=row_group_rows)
+                    total_rows += full_rows
+                    pending = [buffered.slice(full_rows)]
+                    pending_rows -= full_rows
+            
+            if pending_rows:
+                writer.write_table(pa.concat_tables(pending), row_group_size=row_group_rows)
+                total_rows += pending_rows
+    except BaseException:
+        if os.path.exists(temp_output):
+            os.remove(temp_output)
+        raise
+    finally:
+        # 关闭所有来源文件，Windows下被打开的output_file无法被替换
+        for it in iterators:
+            it.close()
+    
+    os.replace(temp_output, output_file)
+    return total_rows
+
+def narrowest_quality_type(source_paths):
+    """按来源文件中质量码列的min/max统计，选出能容纳所有质量码的最窄整数类型，只读取元数据
+
+    临时文件每一列都有统计信息；已有的月度文件只有timestamp列的统计，按它原来的类型算，
+    所以结果不会比已有文件的类型更窄
+    """
+    low, high = 0, 0
+    for path in source_paths:
+        parquet_file = pq.ParquetFile(path)
+        _, columns = read_matrix_layout(parquet_file)
+        quality_fields = {cols['quality'] for cols in columns.values() if 'quality' in cols}
+        schema = parquet_file.schema_arrow
+        metadata = parquet_file.metadata
+        for col_idx, name in enumerate(metadata.schema.names):
+            if name not in quality_fields:
+                continue
+            for rg in range(metadata.num_row_groups):
+                stats = metadata.row_group(rg).column(col_idx).statistics
+                if stats is not None and stats.has_min_max:
+                    low, high = min(low, stats.min), max(high, stats.max)
+                elif stats is None or stats.null_count != metadata.row_group(rg).num_rows:
+                    info = np.iinfo(schema.field(name).type.to_pandas_dtype())
+                    low, high = min(low, info.min), max(high, info.max)
+    for quality_type, _ in QUALITY_TYPES:
+        info = np.iinfo(quality_type.to_pandas_dtype())
+        if info.min <= low and high <= info.max:
+            return quality_type
+    return pa.int64()
+
+def float64_value_tags(source_paths):
+    """来源文件中数值列需要保留float64的tag，只读取元数据
+
+    临时文件的元数据中记录了存成float32会损失精度的tag；已有的月度文件没有这项记录，
+    其中已经是float64的数值列保持float64，所以结果不会比已有文件的精度更低
+    """
+    tags = set()
+    for path in source_paths:
+        parquet_file = pq.ParquetFile(path)
+        key_values = parquet_file.schema_arrow.metadata or {}
+        if b'float64_tags' in key_values:
+            tags.update(json.loads(key_values[b'float64_tags']))
+            continue
+        _, columns = read_matrix_layout(parquet_file)
+        schema = parquet_file.schema_arrow
+        tags.update(tag for tag, cols in columns.items()
+                    if 'value' in cols and schema.field(cols['value']).type == pa.float64())
+    return tags
+
+def month_tag_names(output_file, tag_names):
+    """已有月度文件中的tag在前，新出现的tag追加在后，保证增量合并不会丢掉旧的tag"""
+    if not os.path.exists(output_file):
+        return list(tag_names)
+    existing_tags, _ = read_matrix_tags(pq.ParquetFile(output_file))
+    existing = set(existing_tags)
+    return existing_tags + [tag for tag in tag_names if tag not in existing]
+
+ROLLUP_LEVELS = [('1min', 60), ('10min', 600), ('1h', 3600)]  # 汇总层级名称和时间桶长度(秒)
+ROLLUP_STATS = ('min', 'max', 'mean', 'last', 'count', 'bad')
+
+def build_rollup_schema(tag_names):
+    """汇总文件的schema：索引为时间桶起点，每个tag有min/max/mean/last/count/bad六列
+
+    min/max/mean/count只统计质量码为0的点，bad为异常质量码的点数，last为桶内最后一个值（不论质量码）
+    """
     columns = pd.MultiIndex.from_tuples(
-        [(col.rsplit('_', 1)[0], col.rsplit('_', 1)[1]) 
-         for col in df.columns],
+        [(tag, stat) for tag in tag_names for stat in ROLLUP_STATS],
         names=['tag', 'type']
     )
-    df.columns = columns
+    empty_df = pd.DataFrame(
+        {col: pd.Series(dtype=np.int32 if col[1] in ('count', 'bad') else np.float64) for col in columns},
+        index=pd.DatetimeIndex([], dtype='datetime64[ns]', name='timestamp')
+    )
+    empty_df.columns = columns
+    return pa.Schema.from_pandas(empty_df, preserve_index=True)
+
+def reduce_partials(times, parts, bucket_ns):
+    """把按时间排序的部分汇总结果按时间桶合并
+
+    parts为 {统计量: 行×tag矩阵}，sum/count/bad相加，min/max取极值(忽略NaN)，
+    last取桶内最后一个非NaN值。原始数据可以看作每行一个桶的部分汇总。
+    返回 (桶起点时间, 合并后的parts)
+    """
+    buckets = times // bucket_ns * bucket_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    last = parts['last']
+    rows = np.arange(len(times))[:, None]
+    last_idx = np.maximum.reduceat(np.where(np.isnan(last), -1, rows), starts, axis=0)
+    last_values = np.take_along_axis(last, np.maximum(last_idx, 0), axis=0)
+    last_values[last_idx < 0] = np.nan
+    return buckets[starts], {
+        'min': np.fmin.reduceat(parts['min'], starts, axis=0),
+        'max': np.fmax.reduceat(parts['max'], starts, axis=0),
+        'sum': np.add.reduceat(parts['sum'], starts, axis=0),
+        'count': np.add.reduceat(parts['count'], starts, axis=0),
+        'bad': np.add.reduceat(parts['bad'], starts, axis=0),
+        'last': last_values,
+    }
+
+class RollupLevel:
+    """流式生成一个汇总层级的文件
+
+    输入按时间排序的部分汇总结果，只合并已经完整的时间桶（最后一个桶可能还有后续数据，
+    留到下一次），写出后再交给下一个更粗的层级，整月数据不需要同时放在内存里。
+    """
+    def __init__(self, output_file, tag_names, bucket_seconds, next_level=None):
+        self.output_file = output_file
+        self.temp_output = output_file + '.tmp'
+        self.num_tags = len(tag_names)
+        self.bucket_ns = bucket_seconds * 1_000_000_000
+        self.next_level = next_level
+        self.schema = build_rollup_schema(tag_names)
+        self.writer = pq.ParquetWriter(self.temp_output, self.schema, write_statistics=['timestamp'])
+        self.carry = None
+        self.pending = []
+        self.pending_rows = 0
+    
+    def add(self, times, parts):
+        if self.carry is not None:
+            carry_times, carry_parts = self.carry
+            times = np.concatenate([carry_times, times])
+            parts = {k: np.concatenate([carry_parts[k], parts[k]]) for k in parts}
+        if len(times) == 0:
+            return
+        last_bucket = times[-1] // self.bucket_ns * self.bucket_ns
+        cut = int(np.searchsorted(times, last_bucket, side='left'))
+        self.carry = (times[cut:], {k: v[cut:] for k, v in parts.items()})
+        if cut:
+            self._emit(*reduce_partials(times[:cut], {k: v[:cut] for k, v in parts.items()}, self.bucket_ns))
+    
+    def _emit(self, bucket_times, parts):
+        self.pending.append((bucket_times, parts))
+        self.pending_rows += len(bucket_times)
+        if self.pending_rows >= ROW_GROUP_ROWS:
+            self._flush()
+        if self.next_level is not None:
+            self.next_level.add(bucket_times, parts)
     
-    # 保存临时文件
-    temp_path = os.path.join('temp_parquet', f'temp_batch_{batch_id}.parquet')
-    df.to_parquet(temp_path)
+    def _flush(self):
+        if not self.pending:
+            return
+        times = np.concatenate([t for t, _ in self.pending])
+        parts = {k: np.concatenate([p[k] for _, p in self.pending]) for k in self.pending[0][1]}
+        self.pending, self.pending_rows = [], 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = parts['sum'] / parts['count']
+        stats = {'min': parts['min'], 'max': parts['max'], 'mean': mean, 'last': parts['last'],
+                 'count': parts['count'].astype(np.int32), 'bad': parts['bad'].astype(np.int32)}
+        arrays = [pa.array(stats[stat][:, i]) for i in range(self.num_tags) for stat in ROLLUP_STATS]
+        arrays.append(pa.array(times.view('datetime64[ns]')))
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+    
+    def close(self):
+        if self.carry is not None and len(self.carry[0]):
+            self._emit(*reduce_partials(*self.carry, self.bucket_ns))
+        self.carry = None
+        self._flush()
+        self.writer.close()
+        os.replace(self.temp_output, self.output_file)
+        if self.next_level is not None:
+            self.next_level.close()
+    
+    def abort(self):
+        self.writer.close()
+        if os.path.exists(self.temp_output):
+            os.remove(self.temp_output)
+        if self.next_level is not None:
+            self.next_level.abort()
+
+STATS_PERCENTILES = (1, 5, 50, 95, 99)
+STATS_SAMPLE_ROWS = 4096  # 计算百分位数时每个月最多抽取的行数
+
+class MonthStats:
+    """累计每个tag的整月统计量: 最小、最大、平均值、有效点数、异常质量码点数和百分位数
+
+    除异常质量码点数外都只统计质量码为0的点（与汇总文件相同），异常的哨兵值不会撑大默认的Y轴范围。
+    min/max/mean/count/bad是精确值；百分位数按固定间隔抽取最多STATS_SAMPLE_ROWS行计算，
+    用来给查看器提供去掉个别尖峰的Y轴范围，不需要精确
+    """
+    def __init__(self, tag_names, num_rows):
+        self.tag_names = tag_names
+        num_tags = len(tag_names)
+        self.min = np.full(num_tags, np.nan)
+        self.max = np.full(num_tags, np.nan)
+        self.sum = np.zeros(num_tags)
+        self.count = np.zeros(num_tags, dtype=np.int64)
+        self.bad = np.zeros(num_tags, dtype=np.int64)
+        self.stride = max(1, -(-num_rows // STATS_SAMPLE_ROWS))
+        self.offset = 0  # 下一批数据中第一个抽样行的位置
+        self.samples = []
+    
+    def add(self, values, bad):
+        """values为 行×tag 的数值矩阵（异常质量码的点已置为NaN），bad为异常质量码的布尔矩阵"""
+        valid = ~np.isnan(values)
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=0))
+        self.sum += np.where(valid, values, 0.0).sum(axis=0)
+        self.count += valid.sum(axis=0)
+        self.bad += bad.sum(axis=0)
+        self.samples.append(values[self.offset::self.stride])
+        self.offset = (self.offset - len(values)) % self.stride
+    
+    def write(self, output_file):
+        """写出统计文件，每行一个tag"""
+        samples = np.concatenate(self.samples) if self.samples else np.empty((0, len(self.tag_names)))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # 全为NaN的tag
+            percentiles = np.nanpercentile(samples, STATS_PERCENTILES, axis=0) if len(samples) else \
+                np.full((len(STATS_PERCENTILES), len(self.tag_names)), np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum / self.count
+        columns = {'tag': self.tag_names, 'min': self.min, 'max': self.max, 'mean': mean,
+                   'count': self.count, 'bad': self.bad}
+        for q, values in zip(STATS_PERCENTILES, percentiles):
+            columns[f'p{q}'] = values
+        temp_output = output_file + '.tmp'
+        pq.write_table(pa.table(columns), temp_output)
+        os.replace(temp_output, output_file)
+
+SPARSE_MAX_CHANGE_RATIO = 0.05  # 变化的行数超过整月行数的这个比例的tag不写入变化存储
+QUALITY_NONE = -1  # 比较质量码时代表缺失的质量码
+
+class SparseWriter:
+    """生成一个月的变化存储 sparse_<yyyymm>.parquet
 
-def fetch_data():
-    """获取并处理数据"""
-    root_folder = "."
+    按时间顺序输入整月的数据，每个tag只保留与上一次保留的行相比数值变化超过死区、
+    数值在有无之间变化或质量码变化的行；每个tag的第一行总是保留，所以每个月的文件可以单独还原。
+    死区为0的tag整批向量化比较；死区大于0的tag需要和上一次保留的值比较，只对数值有变化的行逐行判断。
+    变化太频繁的tag（超过SPARSE_MAX_CHANGE_RATIO）中途放弃，只保留在月度文件中，
+    所以各tag的缓冲总共不超过整月数据的这个比例。
+    输出按tag、时间排序，tag和timestamp列带统计信息，查看器只读取包含所选tag的row group；
+    文件的元数据中记录收录的tag、死区大于0的tag的死区和本月最后的时间戳（最后一段阶梯的终点）。
+    变化存储是月度文件之外额外写的一份，月度文件不变，所以存档只会变大，不会变小（每个tag增加的行数
+    不超过整月行数的SPARSE_MAX_CHANGE_RATIO），换来的是查看器读取收录的tag时读得少得多。
+    死区为0的tag可以精确还原；死区大于0的tag还原出的值与原始值最多相差死区，查看器在读数和标注中注明死区。
+    """
+    def __init__(self, output_file, tag_names, num_rows, value_types, quality_type, deadbands=None):
+        self.output_file = output_file
+        self.tag_names = tag_names
+        self.value_types = value_types
+        self.quality_type = quality_type
+        num_tags = len(tag_names)
+        deadbands = deadbands or {}
+        self.deadbands = np.array([deadbands.get(tag, 0.0) for tag in tag_names], dtype=np.float64)
+        self.deadband_cols = np.flatnonzero(self.deadbands > 0)
+        self.max_changes = max(1, int(num_rows * SPARSE_MAX_CHANGE_RATIO))
+        # 每个tag上一次保留的值和质量码，一开始都没有
+        self.last_values = np.full(num_tags, np.nan)
+        self.last_qualities = np.full(num_tags, QUALITY_NONE - 1, dtype=np.int64)
+        self.buffers = [[] for _ in range(num_tags)]
+        self.counts = np.zeros(num_tags, dtype=np.int64)
+        self.active = np.ones(num_tags, dtype=bool)
+        self.last_time = None
+    
+    def add(self, times, values, qualities):
+        """values为 行×tag 的float64矩阵，qualities为缺失时等于QUALITY_NONE的整数矩阵"""
+        if len(times) == 0:
+            return
+        prev_values = np.vstack([self.last_values, values[:-1]])
+        prev_qualities = np.vstack([self.last_qualities, qualities[:-1]])
+        same_value = (values == prev_values) | (np.isnan(values) & np.isnan(prev_values))
+        changed = ~same_value | (qualities != prev_qualities)
+        changed[:, ~self.active] = False
+        
+        for col in self.deadband_cols:
+            if not self.active[col]:
+                continue
+            deadband = self.deadbands[col]
+            kept_value, kept_quality = self.last_values[col], self.last_qualities[col]
+            keep = []
+            for row in np.flatnonzero(changed[:, col]):
+                value, quality = values[row, col], qualities[row, col]
+                if (quality != kept_quality or np.isnan(value) != np.isnan(kept_value)
+                        or abs(value - kept_value) > deadband):
+                    keep.append(row)
+                    kept_value, kept_quality = value, quality
+            changed[:, col] = False
+            changed[keep, col] = True
+            self.last_values[col], self.last_qualities[col] = kept_value, kept_quality
+        
+        # 死区为0的tag上一次保留的值就是上一行的值
+        plain = np.ones(len(self.tag_names), dtype=bool)
+        plain[self.deadband_cols] = False
+        self.last_values[plain] = values[-1, plain]
+        self.last_qualities[plain] = qualities[-1, plain]
+        self.last_time = times[-1]
+        
+        cols, rows = np.nonzero(changed.T)
+        bounds = np.flatnonzero(np.r_[True, cols[1:] != cols[:-1], True]) if len(cols) else []
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            col = cols[begin]
+            tag_rows = rows[begin:end]
+            self.counts[col] += len(tag_rows)
+            if self.counts[col] > self.max_changes:
+                self.active[col] = False
+                self.buffers[col] = []
+                continue
+            self.buffers[col].append((times[tag_rows], values[tag_rows, col], qualities[tag_rows, col]))
+    
+    def close(self):
+        """按tag名排序写出收录的tag，返回收录的tag数量"""
+        kept = sorted((self.tag_names[col], col) for col in np.flatnonzero(self.active) if self.buffers[col])
+        value_type = pa.float64() if any(self.value_types[tag] == pa.float64() for tag, _ in kept) else pa.float32()
+        tags, times, values, qualities = [], [], [], []
+        for tag, col in kept:
+            for t, v, q in self.buffers[col]:
+                tags.append(np.full(len(t), tag, dtype=object))
+                times.append(t)
+                values.append(v)
+                qualities.append(q)
+        
+        def concat(parts, dtype):
+            return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        
+        quality_values = concat(qualities, np.int64)
+        table = pa.table({
+            'tag': pa.array(concat(tags, object), type=pa.string()).dictionary_encode(),
+            'timestamp': pa.array(concat(times, np.int64).view('datetime64[ns]')),
+            'value': pa.array(concat(values, np.float64)).cast(value_type),
+            'quality': pa.array(quality_values, mask=quality_values == QUALITY_NONE).cast(self.quality_type),
+        })
+        last_time = '' if self.last_time is None else str(int(self.last_time))
+        table = table.replace_schema_metadata({
+            'sparse_tags': json.dumps([tag for tag, _ in kept]),
+            'sparse_deadbands': json.dumps({tag: float(self.deadbands[col]) for tag, col in kept
+                                            if self.deadbands[col] > 0}),
+            'last_timestamp': last_time})
+        temp_output = self.output_file + '.tmp'
+        pq.write_table(table, temp_output, row_group_size=ROW_GROUP_ROWS, write_statistics=['tag', 'timestamp'])
+        os.replace(temp_output, self.output_file)
+        return len(kept)
+
+PREFIX_STORE_DIR = 'by_prefix'  # 按tag前缀分区的数据文件所在的子目录
+
+class PrefixPartitionWriter:
+    """把月度文件按tag前缀(tag.split('-')[0]，与查看器的树形分组相同)拆成多个窄文件
+    <目录>/data_<前缀>_<yyyymm>.parquet
+
+    每个文件的结构与月度文件相同（pandas元数据、列类型、row group大小、timestamp统计），只包含一个前缀的tag；
+    文件尾部的元数据也只有月度文件的几分之一，打开一年的文件代价小得多
+    """
+    def __init__(self, output_dir, month_key, schema, index_column, columns):
+        self.index_column = index_column
+        os.makedirs(output_dir, exist_ok=True)
+        groups = {}
+        for tag in columns:
+            groups.setdefault(tag.split('-')[0], []).append(tag)
+        quality_type = next((schema.field(cols['quality']).type for cols in columns.values() if 'quality' in cols),
+                            pa.int64())
+        
+        self.parts = []  # [(输出文件, schema, 来源列名, writer)]
+        try:
+            for prefix, tags in sorted(groups.items()):
+                float64_tags = [tag for tag in tags if schema.field(columns[tag]['value']).type == pa.float64()]
+                part_schema = build_matrix_schema(tags, 'float32', quality_type, float64_tags)
+                fields = [columns[tag][col_type] for tag in tags for col_type in ('value', 'quality')]
+                output_file = os.path.join(output_dir, f'data_{prefix}_{month_key}.parquet')
+                writer = pq.ParquetWriter(output_file + '.tmp', part_schema, write_statistics=['timestamp'])
+                self.parts.append((output_file, part_schema, fields, writer))
+        except BaseException:
+            self.abort()
+            raise
+        self.output_files = {part[0] for part in self.parts}
+    
+    def add(self, batch):
+        for _, part_schema, fields, writer in self.parts:
+            arrays = [batch.column(field) for field in fields] + [batch.column(self.index_column)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=part_schema), row_group_size=ROW_GROUP_ROWS)
+    
+    def close(self):
+        for output_file, _, _, writer in self.parts:
+            writer.close()
+            os.replace(output_file + '.tmp', output_file)
+    
+    def abort(self):
+        for output_file, _, _, writer in self.parts:
+            writer.close()
+            if os.path.exists(output_file + '.tmp'):
+                os.remove(output_file + '.tmp')
+
+def remove_stale_partitions(prefix_dir, month_key, keep=()):
+    """删除这个月不再生成的前缀分区文件，避免查看器读到过时的数据"""
+    if not os.path.isdir(prefix_dir):
+        return
+    for file_name in os.listdir(prefix_dir):
+        path = os.path.join(prefix_dir, file_name)
+        if file_name.startswith('data_') and file_name.endswith(f'_{month_key}.parquet') and path not in keep:
+            os.remove(path)
+
+def write_month_outputs(month_file, month_key, output_dir='.', deadbands=None, prefix_store=False):
+    """按行组流式读取一遍月度文件，生成由它派生的文件：
+    各层级的汇总文件 rollup_<层级>_<yyyymm>.parquet 和整月统计 stats_<yyyymm>.parquet；
+    deadbands不为None时生成变化存储 sparse_<yyyymm>.parquet（{tag: 死区}，没有列出的tag死区为0）；
+    prefix_store为True时生成按前缀分区的文件。不生成的可选文件如果这个月已有，会被删除，避免留下过时的数据"""
+    parquet_file = pq.ParquetFile(month_file)
+    index_column, columns = read_matrix_layout(parquet_file)
+    tag_names = [tag for tag, cols in columns.items() if 'value' in cols and 'quality' in cols]
+    value_fields = [columns[tag]['value'] for tag in tag_names]
+    quality_fields = [columns[tag]['quality'] for tag in tag_names]
+    
+    # 从最粗的层级开始建立，每一层把结果交给下一层
+    level = None
+    for name, bucket_seconds in reversed(ROLLUP_LEVELS):
+        output_file = os.path.join(output_dir, f'rollup_{name}_{month_key}.parquet')
+        level = RollupLevel(output_file, tag_names, bucket_seconds, level)
+    stats = MonthStats(tag_names, parquet_file.metadata.num_rows)
+    sparse_file = os.path.join(output_dir, f'sparse_{month_key}.parquet')
+    sparse = None
+    if deadbands is not None:
+        schema = parquet_file.schema_arrow
+        sparse = SparseWriter(sparse_file, tag_names, parquet_file.metadata.num_rows,
+                              {tag: schema.field(field).type for tag, field in zip(tag_names, value_fields)},
+                              schema.field(quality_fields[0]).type if quality_fields else pa.int64(), deadbands)
+    elif os.path.exists(sparse_file):
+        os.remove(sparse_file)
+    prefix_dir = os.path.join(output_dir, PREFIX_STORE_DIR)
+    partitions = None
+    if prefix_store:
+        partitions = PrefixPartitionWriter(prefix_dir, month_key, parquet_file.schema_arrow, index_column,
+                                           {tag: columns[tag] for tag in tag_names})
+    remove_stale_partitions(prefix_dir, month_key, partitions.output_files if partitions else ())
+    
+    try:
+        for batch in parquet_file.iter_batches(batch_size=ROW_GROUP_ROWS,
+                                               columns=[index_column] + value_fields + quality_fields):
+            times = batch.column(index_column).to_numpy().astype('datetime64[ns]').view(np.int64)
+            # float32存储的数值也按float64累计；缺失的质量码记为QUALITY_NONE，对应的数值为NaN，不计入任何统计
+            values = np.column_stack([batch.column(f).to_numpy(zero_copy_only=False) for f in value_fields]
+                                     ).astype(np.float64, copy=False)
+            qualities = np.column_stack([batch.column(f).cast(pa.int64()).fill_null(QUALITY_NONE).to_numpy()
+                                         for f in quality_fields])
+            bad = (qualities != 0) & (qualities != QUALITY_NONE)
+            # 汇总和整月统计的包络、平均值、点数和百分位数与查看器中的正常数据曲线一致，只统计质量码为0的点；
+            # 异常点只计入bad，汇总的last不论质量码，用于标记异常的桶
+            good_values = np.where(qualities == 0, values, np.nan)
+            good = ~np.isnan(good_values)
+            level.add(times, {
+                'min': good_values, 'max': good_values, 'last': values,
+                'sum': np.where(good, good_values, 0.0),
+                'count': good.astype(np.int64),
+                'bad': bad.astype(np.int64),
+            })
+            stats.add(good_values, bad)
+            if sparse is not None:
+                sparse.add(times, values, qualities)
+            if partitions is not None:
+                partitions.add(batch)
+        level.close()
+        stats.write(os.path.join(output_dir, f'stats_{month_key}.parquet'))
+        if sparse is not None:
+            num_sparse = sparse.close()
+            print(f"变化存储 {sparse_file} 收录 {num_sparse}/{len(tag_names)} 个tag")
+        if partitions is not None:
+            partitions.close()
+    except BaseException:
+        level.abort()
+        if partitions is not None:
+            partitions.abort()
+        raise
+
+MANIFEST_FILE = 'ingest_manifest.json'
+MERGE_MEMORY_BUDGET = 512 * 1024 * 1024  # 合并阶段的内存预算，512MB
+ROW_GROUP_ROWS = 8192  # 月度文件每个row group的最大行数，约1.4天
+
+def load_manifest(manifest_path):
+    """读取入库清单，不存在或损坏时返回空清单"""
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('folders'), dict):
+                return manifest
+            logging.warning(f"入库清单格式不正确，将重新建立: {manifest_path}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取入库清单出错，将重新建立: {manifest_path} - {str(e)}")
+    return {'version': 1, 'folders': {}}
+
+def write_json(data, path):
+    """先写临时文件再替换，避免中途失败把文件写坏；入库清单、tag目录和运行报告都用它保存"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(temp_path, path)
+
+def save_manifest(manifest, manifest_path):
+    """记下更新时间后保存入库清单"""
+    manifest['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    write_json(manifest, manifest_path)
+
+TAG_CATALOG_FILE = 'tag_catalog.json'
+
+def read_time_bounds(parquet_file, index_column):
+    """月度文件的起止时间，来自timestamp列的row group统计信息，没有统计信息时读取时间列"""
+    metadata = parquet_file.metadata
+    col_idx = metadata.schema.names.index(index_column)
+    bounds = []
+    for rg in range(metadata.num_row_groups):
+        stats = metadata.row_group(rg).column(col_idx).statistics
+        if stats is None or not stats.has_min_max:
+            times = parquet_file.read(columns=[index_column]).column(0).to_numpy()
+            return (pd.Timestamp(times.min()), pd.Timestamp(times.max())) if len(times) else (None, None)
+        bounds.append((pd.Timestamp(stats.min), pd.Timestamp(stats.max)))
+    if not bounds:
+        return None, None
+    return min(b[0] for b in bounds), max(b[1] for b in bounds)
+
+def update_tag_catalog(catalog, month_file, month_key):
+    """把一个月度数据文件中的tag和时间范围记入tag目录，只读取parquet元数据"""
+    parquet_file = pq.ParquetFile(month_file)
+    index_column, columns = read_matrix_layout(parquet_file)
+    schema = parquet_file.schema_arrow
+    start, end = read_time_bounds(parquet_file, index_column)
+    if start is not None:
+        catalog['months'][month_key] = {'start': start.strftime('%Y-%m-%d %H:%M:%S'),
+                                        'end': end.strftime('%Y-%m-%d %H:%M:%S'),
+                                        'rows': parquet_file.metadata.num_rows}
+    for tag, cols in columns.items():
+        entry = catalog['tags'].setdefault(tag, {'prefix': tag.split('-')[0],
+                                                 'first_month': month_key, 'last_month': month_key})
+        entry['first_month'] = min(entry['first_month'], month_key)
+        entry['last_month'] = max(entry['last_month'], month_key)
+        if 'value' in cols:
+            entry['dtype'] = str(schema.field(cols['value']).type)
+
+def load_tag_catalog(root_folder):
+    """读取tag目录，不存在或损坏时根据已有月度数据文件的元数据重新建立"""
+    catalog_path = os.path.join(root_folder, TAG_CATALOG_FILE)
+    if os.path.exists(catalog_path):
+        try:
+            with open(catalog_path, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+            if isinstance(catalog.get('tags'), dict) and isinstance(catalog.get('months'), dict):
+                return catalog
+            logging.warning(f"tag目录格式不正确，将重新建立: {catalog_path}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取tag目录出错，将重新建立: {catalog_path} - {str(e)}")
+    
+    catalog = {'version': 1, 'months': {}, 'tags': {}}
+    for file_name in sorted(os.listdir(root_folder)):
+        if file_name.startswith('data_matrix_') and file_name.endswith('.parquet'):
+            try:
+                update_tag_catalog(catalog, os.path.join(root_folder, file_name),
+                                   file_name[len('data_matrix_'):-len('.parquet')])
+            except Exception as e:
+                logging.warning(f"读取 {file_name} 的元数据出错: {str(e)}")
+    return catalog
+
+def get_file_month(file_name):
+    """从文件名 xxx_yyyymmddHHMMSS.raw 中取出月份 yyyymm，文件名中没有时间戳时返回None"""
+    try:
+        stamp = file_name.split('_')[1].split('.')[0]
+        datetime.strptime(stamp, '%Y%m%d%H%M%S')
+    except (IndexError, ValueError):
+        return None
+    return stamp[:6]
+
+CHUNK_BYTES = 32 * 1024 * 1024  # 每个任务块的raw文件总大小上限，约800个文件
+
+def plan_file_chunks(files, file_sizes, chunk_bytes=CHUNK_BYTES):
+    """把需要处理的文件按 (日期文件夹, 月份) 分组，每组按文件大小均分成不超过chunk_bytes的任务块
+
+    任务块不跨越日期和月份，按时间顺序排列：进程池按顺序分发，一个月的块全部完成后就可以开始合并这个月，
+    块很小，最后一块完成时其他进程也不会空等太久。file_sizes中没有的文件按0字节计，
+    文件名中没有时间戳的文件不属于任何月份，跳过。
+    返回 [(文件列表, 月份)]
+    """
+    groups = {}
+    for file_path in files:
+        month_key = get_file_month(os.path.basename(file_path))
+        if month_key is not None:
+            groups.setdefault((os.path.basename(os.path.dirname(file_path)), month_key), []).append(file_path)
+    
+    chunks = []
+    for (_, month_key), group in sorted(groups.items()):
+        group.sort()
+        cum_sizes = np.cumsum([file_sizes.get(path, 0) for path in group])
+        num_chunks = max(1, int(np.ceil(cum_sizes[-1] / chunk_bytes)))
+        # 在累计大小的等分点切开，各块大小相近
+        cuts = np.searchsorted(cum_sizes, cum_sizes[-1] * np.arange(1, num_chunks) / num_chunks, side='right')
+        bounds = [0] + cuts.tolist() + [len(group)]
+        chunks.extend((group[lo:hi], month_key) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo)
+    return chunks
+
+def collect_raw_files(root_folder, manifest, incremental=True, trust_folder_mtime=False):
+    """收集需要处理的raw文件
+
+    增量模式下逐个文件比较os.scandir的mtime/size和清单中的记录，跳过都没有变化的文件。
+    trust_folder_mtime=True时文件夹本身的mtime没变就直接跳过整个文件夹：新增或删除文件会改变文件夹mtime，
+    但原地改写已有的文件不会，所以只适合文件写入后不再修改的存档。
+    返回 (需要处理的文件列表, 本次扫描到的文件信息)
+    """
+    new_files = []
+    scanned = {}
+    for folder_name in sorted(os.listdir(root_folder)):
+        folder_path = os.path.join(root_folder, folder_name)
+        if not os.path.isdir(folder_path):
+            continue
+        try:
+            datetime.strptime(folder_name, '%Y%m%d')
+        except ValueError:
+            continue
+        
+        # 先取文件夹mtime再列目录，扫描过程中新增的文件会在下次运行时被发现
+        folder_mtime = os.stat(folder_path).st_mtime_ns
+        recorded = manifest['folders'].get(folder_name, {}) if incremental else {}
+        if trust_folder_mtime and recorded.get('mtime_ns') == folder_mtime:
+            continue
+        
+        recorded_files = recorded.get('files', {})
+        folder_files = {}
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.raw'):
+                    continue
+                stat = entry.stat()
+                folder_files[entry.name] = [stat.st_mtime_ns, stat.st_size]
+                if recorded_files.get(entry.name) != folder_files[entry.name]:
+                    new_files.append(os.path.join(folder_path, entry.name))
+        scanned[folder_name] = {'mtime_ns': folder_mtime, 'files': folder_files}
+    
+    return new_files, scanned
+
+def update_manifest(manifest, scanned, failed_months):
+    """把已成功入库的文件写入清单，写入失败月份的文件留到下次重新处理"""
+    for folder_name, info in scanned.items():
+        entry = manifest['folders'].setdefault(folder_name, {'files': {}})
+        folder_ok = True
+        for file_name, file_info in info['files'].items():
+            if get_file_month(file_name) in failed_months:
+                folder_ok = False
+                continue
+            entry['files'][file_name] = file_info
+        # 只有整个文件夹都入库成功才记录文件夹mtime，否则下次还要逐个文件检查
+        if folder_ok:
+            entry['mtime_ns'] = info['mtime_ns']
+        else:
+            entry.pop('mtime_ns', None)
+
+def fetch_data(root_folder=".", incremental=True, trust_folder_mtime=False, merge_memory_budget=MERGE_MEMORY_BUDGET,
+               value_type=VALUE_TYPE, float64_tags=(), deadbands=None, prefix_store=False,
+               workers=None, chunk_bytes=CHUNK_BYTES, float32_tolerance=FLOAT32_TOLERANCE):
+    """获取并处理数据
+
+    Args:
+        root_folder: 存档根目录，下面是yyyymmdd格式的文件夹
+        incremental: True时只处理清单中没有或mtime/size变化过的文件，
+            并把新数据合并进已有的月度parquet；False时全部重新处理。
+            增量模式只解析新文件，没有新数据的月份不会改动；但有新数据的月份，其月度文件和派生文件
+            (汇总、统计、变化存储、前缀分区)都要整个重新写出，耗时与整月的数据量成正比，
+            不只与新数据量有关。运行报告中每个月的existing_rows是为此重写的已有行数
+        trust_folder_mtime: 增量模式下跳过mtime没有变化的文件夹，不再逐个文件检查；
+            原地改写的文件不会被发现，只适合文件写入后不再修改的存档
+        merge_memory_budget: 合并阶段的内存预算(字节)
+        value_type: 月度文件数值列的存储类型，'float32'或'float64'
+        float64_tags: 总是保留float64精度的tag；其他tag在数据存成float32会损失精度时也自动保留float64
+        deadbands: 不为None时为每个月生成变化存储，{tag: 死区}，没有列出的tag只记录精确的变化
+        prefix_store: 为True时为每个月生成按tag前缀分区的文件
+        workers: 解析用的进程数，None时等于CPU核数
+        chunk_bytes: 每个任务块的raw文件总大小上限(字节)
+        float32_tolerance: float32与原值的最大误差，某个月超过它的tag在这个月的文件中保留float64
+    """
     MAX_FILE_SIZE = 1 * 1024 * 1024 * 1024  # 1GB
+    run_start = time.perf_counter()
+    manifest_path = os.path.join(root_folder, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path) if incremental else {'version': 1, 'folders': {}}
+    catalog_path = os.path.join(root_folder, TAG_CATALOG_FILE)
+    catalog = load_tag_catalog(root_folder)
     
     # 创建临时目录
     temp_dir = "temp_parquet"
@@ -95,95 +1147,143 @@ def fetch_data():
         os.makedirs(temp_dir)
     
     # 集所有需要处理的文件
-    all_files = []
     print("正在收集文件...")
-    for folder_name in os.listdir(root_folder):
-        if not os.path.isdir(os.path.join(root_folder, folder_name)):
-            continue
-        try:
-            datetime.strptime(folder_name, '%Y%m%d')
-        except ValueError:
-            continue
-            
-        folder_path = os.path.join(root_folder, folder_name)
-        for file_name in os.listdir(folder_path):
-            if file_name.endswith('.raw'):
-                all_files.append(os.path.join(folder_path, file_name))
+    all_files, scanned = collect_raw_files(root_folder, manifest, incremental, trust_folder_mtime)
     
-    if not all_files:
-        print("未找到任何raw文件")
-        return False
-        
-    # 从第一个文件获取tag_names
+    # 运行报告：各批次耗时、各月合并耗时和按文件/tag/类型汇总的解析错误；提前结束时也写出
+    metrics = IngestMetrics()
+    report = {'started': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'root_folder': os.path.abspath(root_folder),
+              'incremental': incremental, 'files': len(all_files), 'merge_seconds': 0.0, 'months': {}}
+    failed_months = set()
     tag_names = []
-    print("从第一个文件获取tag列表...")
-    with open(all_files[0], 'r') as f:
-        for _ in range(3):
-            next(f)
-        for line in f:
-            line = line.strip()
-            if not line or line in ['Dx', 'Ax']:
-                continue
-            parts = line.split()
-            if len(parts) >= 4:
-                tag_names.append(parts[1])
     
-    print(f"共获取到 {len(tag_names)} 个tag")
-    
-    # 增加次大小，减少文件数量
-    batch_size = 5000  # 增加到5000
-    num_cores = min(mp.cpu_count(), 8)
-    
-    file_batches = [(all_files[i:i + batch_size], i // batch_size, tag_names) 
-                    for i in range(0, len(all_files), batch_size)]
+    def merge_ready_month(month_key):
+        """合并一个所有任务块都已完成的月份：多路归并临时文件后流式写出，再生成派生文件"""
+        sources = []
+        for temp_file in os.listdir(temp_dir):
+            batch_id, file_month = temp_file[len('temp_batch_'):-len('.parquet')].split('_')
+            if file_month == month_key:
+                sources.append((int(batch_id), os.path.join(temp_dir, temp_file)))
+        if not sources:
+            return
+        month_report = report['months'].setdefault(month_key, {})
+        month_report['sources'] = len(sources)
+        start_month = time.perf_counter()
+        try:
+            print(f"处理 {month_key} 的数据（{len(sources)} 个临时文件）...")
+            output_file = os.path.join(root_folder, f'data_matrix_{month_key}.parquet')
+            # 后面的批次优先，已有数据优先级最低，重复的时间戳保留新解析的数据
+            source_paths = [path for _, path in sorted(sources)]
+            if incremental and os.path.exists(output_file):
+                source_paths.insert(0, output_file)
+                month_tags = month_tag_names(output_file, tag_names)
+                month_report['existing_rows'] = pq.read_metadata(output_file).num_rows
+                print(f"{month_key} 已有 {month_report['existing_rows']} 行，和新数据一起重新写出")
+            else:
+                month_tags = tag_names
+            schema = build_matrix_schema(month_tags, value_type, narrowest_quality_type(source_paths),
+                                         set(float64_tags) | float64_value_tags(source_paths))
+            start = time.perf_counter()
+            num_rows = merge_month(source_paths, output_file, schema, merge_memory_budget)
+            month_report.update(rows=num_rows, merge_seconds=time.perf_counter() - start)
+            print(f"已生成数据文件: {output_file}，共 {num_rows} 行")
+            start = time.perf_counter()
+            write_month_outputs(output_file, month_key, root_folder, deadbands, prefix_store)
+            update_tag_catalog(catalog, output_file, month_key)
+            month_report['derived_seconds'] = time.perf_counter() - start
+        except Exception as e:
+            print(f"保存 {month_key} 的数据时出错: {str(e)}")
+            failed_months.add(month_key)
+            month_report['error'] = str(e)
+        finally:
+            # 已合并的临时文件立即删除，不必等到全部结束
+            for _, path in sources:
+                os.remove(path)
+            report['merge_seconds'] += time.perf_counter() - start_month
     
-    print(f"将使用 {num_cores} 个进程处理数据，每批 {batch_size} 个文件")
+    def save_progress():
+        """把入库成功的文件写入清单，连同tag目录一起保存"""
+        update_manifest(manifest, scanned, failed_months)
+        save_manifest(manifest, manifest_path)
+        write_json(catalog, catalog_path)
     
     try:
-        with ProcessPoolExecutor(max_workers=num_cores) as executor:
-            list(tqdm(
-                executor.map(process_file_batch, file_batches),
-                total=len(file_batches),
-                desc="处理进度"
-            ))
+        if not all_files:
+            if incremental and manifest['folders']:
+                print("没有新增或修改过的raw文件")
+                save_progress()
+                return True
+            print("未找到任何raw文件")
+            return False
         
-        # 合并临时文件
-        print("正在合并数据文件...")
-        temp_files = [f for f in os.listdir(temp_dir) if f.endswith('.parquet')]
+        if incremental:
+            print(f"增量模式: 共 {len(all_files)} 个新增或修改过的文件")
         
-        # 用于按月分组的字典
-        monthly_dfs = {}
+        # 文件名中没有时间戳的文件无法确定所属的月份，计为bad_filename后跳过；
+        # 它们和其他文件一样记入清单，下次运行不会再次检查
+        valid_files = []
+        for file_path in all_files:
+            if get_file_month(os.path.basename(file_path)) is None:
+                metrics.error('bad_filename', os.path.basename(file_path))
+            else:
+                valid_files.append(file_path)
+        if metrics.total:
+            logging.warning(f"跳过 {metrics.total} 个文件名中没有时间戳的文件")
+        if not valid_files:
+            print("没有文件名可以识别的raw文件")
+            save_progress()
+            return False
         
-        print(f"找到 {len(temp_files)} 个临时文件待合并")
+        # 从第一个文件获取tag_names
+        print("从第一个文件获取tag列表...")
+        parsed = parse_raw_file_bulk(valid_files[0])
+        if parsed is None:
+            print(f"无法读取第一个文件: {valid_files[0]}")
+            return False
+        tag_names = parsed[1]
         
-        for temp_file in tqdm(temp_files, desc="合并文件进度"):
-            try:
-                temp_path = os.path.join(temp_dir, temp_file)
-                df = pd.read_parquet(temp_path)
-                
-                # 按月分组
-                for date, group in df.groupby(df.index.to_period('M')):
-                    month_key = date.strftime('%Y%m')
-                    if month_key not in monthly_dfs:
-                        monthly_dfs[month_key] = []
-                    monthly_dfs[month_key].append(group)
-                
-            except Exception as e:
-                print(f"处理文件 {temp_file} 时出错: {str(e)}")
-                continue
+        print(f"共获取到 {len(tag_names)} 个tag")
         
-        # 按月保存数据
-        for month_key, dfs in monthly_dfs.items():
-            try:
-                print(f"处理 {month_key} 的数据...")
-                final_df = pd.concat(dfs, axis=0)
-                final_df.sort_index(inplace=True)
-                output_file = f'data_matrix_{month_key}.parquet'
-                final_df.to_parquet(output_file)
-                print(f"已生成数据文件: {output_file}")
-            except Exception as e:
-                print(f"保存 {month_key} 的数据时出错: {str(e)}")
+        # 按日期文件夹分成按大小均分的小任务块，进程池按时间顺序逐块分发，空闲的进程直接取下一块
+        num_workers = workers or mp.cpu_count()
+        file_sizes = {os.path.join(root_folder, folder_name, file_name): info[1]
+                      for folder_name, entry in scanned.items() for file_name, info in entry['files'].items()}
+        chunks = plan_file_chunks(valid_files, file_sizes, chunk_bytes)
+        pending_chunks = Counter(month_key for _, month_key in chunks)
+        report.update(workers=num_workers, chunks=len(chunks), chunk_mb=chunk_bytes / (1024 * 1024))
+        
+        print(f"将使用 {num_workers} 个进程处理数据，共 {len(chunks)} 个任务块，每块不超过 {chunk_bytes / (1024 * 1024):g}MB")
+        
+        parse_start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(process_file_batch, (files, batch_id, tag_names, float32_tolerance)): month_key
+                       for batch_id, (files, month_key) in enumerate(chunks)}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="处理进度"):
+                month_key = futures[future]
+                try:
+                    metrics.merge(future.result())
+                except Exception as e:
+                    logging.error(f"处理 {month_key} 的任务块时出错: {str(e)}")
+                    failed_months.add(month_key)
+                    report['months'].setdefault(month_key, {})['error'] = str(e)
+                pending_chunks[month_key] -= 1
+                if not pending_chunks[month_key] and month_key not in failed_months:
+                    # 这个月的任务块都已完成，主进程开始合并，其他进程继续解析后面的月份
+                    merge_ready_month(month_key)
+        report['parse_seconds'] = time.perf_counter() - parse_start
+        if metrics.total:
+            print(f"解析时共有 {metrics.total} 处错误: {metrics.summary()}")
+        
+        save_progress()
+        report['failed_months'] = sorted(failed_months)
+        print("处理完成")
+        return not failed_months
         
+    except Exception as e:
+        logging.error(f"处理文件时出错: {str(e)}")
+        report['error'] = str(e)
+        return False
+    finally:
         # 清理临时文件
         print("清理临时文件...")
         for file in os.listdir(temp_dir):
@@ -191,14 +1291,112 @@ def fetch_data():
                 os.remove(os.path.join(temp_dir, file))
             except Exception as e:
                 print(f"删除临时文件 {file} 时出错: {str(e)}")
-                
-        os.rmdir(temp_dir)
-        print("处理完成")
+        try:
+            os.rmdir(temp_dir)
+        except OSError as e:
+            print(f"删除临时目录 {temp_dir} 时出错: {str(e)}")
         
-    except Exception as e:
-        logging.error(f"处理文件时出错: {str(e)}")
-        return False
+        report['finished'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        report['seconds'] = time.perf_counter() - run_start
+        report['batches'] = sorted(metrics.batches, key=lambda batch: batch['batch_id'])
+        report['errors'] = metrics.to_dict()
+        report_path = os.path.join(root_folder, RUN_REPORT_FILE)
+        write_json(report, report_path)
+        print(f"运行报告已保存到 {report_path}")
+
+def storage_report(month_file, repeat=3):
+    """把月度文件按旧格式(数值float64、质量码int64、缺失的质量码为0)另存一份临时文件，
+    比较文件大小、整表读取时间(取repeat次中最快的)和读入后的内存占用"""
+    parquet_file = pq.ParquetFile(month_file)
+    index_column, columns = read_matrix_layout(parquet_file)
+    row_group_rows = parquet_file.metadata.row_group(0).num_rows if parquet_file.metadata.num_row_groups else ROW_GROUP_ROWS
+    parquet_file.close()
+    
+    table = pq.read_table(month_file)
+    legacy_schema = build_matrix_schema(list(columns))
+    legacy_arrays = []
+    for field in legacy_schema:
+        column = table.column(index_column if field.name == 'timestamp' else field.name)
+        if pa.types.is_integer(field.type):
+            column = column.fill_null(0)
+        legacy_arrays.append(column.cast(field.type))
+    legacy_file = month_file + '.legacy.tmp'
+    pq.write_table(pa.Table.from_arrays(legacy_arrays, schema=legacy_schema), legacy_file,
+                   row_group_size=row_group_rows, write_statistics=['timestamp'])
+    
+    def best_read(path):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            loaded = pq.read_table(path)
+            best = min(best, time.perf_counter() - start)
+        return best, loaded.nbytes
+    
+    try:
+        read_time, memory = best_read(month_file)
+        legacy_read_time, legacy_memory = best_read(legacy_file)
+        return {
+            'rows': table.num_rows,
+            'size': os.path.getsize(month_file), 'legacy_size': os.path.getsize(legacy_file),
+            'read_time': read_time, 'legacy_read_time': legacy_read_time,
+            'memory': memory, 'legacy_memory': legacy_memory,
+        }
+    finally:
+        os.remove(legacy_file)
+
+def print_storage_report(root_folder='.'):
+    """逐个月度文件打印与旧格式相比的大小、读取时间和内存占用"""
+    month_files = sorted(f for f in os.listdir(root_folder)
+                         if f.startswith('data_matrix_') and f.endswith('.parquet'))
+    if not month_files:
+        print("未找到任何月度数据文件")
+        return
+    mb = 1024 * 1024
+    print(f"{'文件':<28}{'行数':>10}{'文件MB':>10}{'旧格式MB':>10}{'读取s':>9}{'旧格式s':>9}{'内存MB':>9}{'旧格式MB':>10}")
+    for file_name in month_files:
+        r = storage_report(os.path.join(root_folder, file_name))
+        print(f"{file_name:<28}{r['rows']:>10}{r['size'] / mb:>10.1f}{r['legacy_size'] / mb:>10.1f}"
+              f"{r['read_time']:>9.2f}{r['legacy_read_time']:>9.2f}{r['memory'] / mb:>9.1f}{r['legacy_memory'] / mb:>10.1f}"
+              f"  (文件 {r['size'] / r['legacy_size']:.0%}, 读取 {r['read_time'] / r['legacy_read_time']:.0%})")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把yyyymmdd文件夹中的raw文件整理成按月的parquet数据")
+    parser.add_argument('--full', action='store_true', help="忽略入库清单，重新处理全部文件")
+    parser.add_argument('--trust-folder-mtime', action='store_true',
+                        help="增量模式下跳过mtime没有变化的文件夹，不逐个文件检查（原地改写的文件不会被发现）")
+    parser.add_argument('--merge-memory-mb', type=int, default=MERGE_MEMORY_BUDGET // (1024 * 1024),
+                        help="合并阶段的内存预算(MB)")
+    parser.add_argument('--value-type', choices=['float32', 'float64'], default=VALUE_TYPE,
+                        help="月度文件数值列的存储类型")
+    parser.add_argument('--float64-tags', default='', help="总是保留float64精度的tag，用逗号分隔")
+    parser.add_argument('--float32-tolerance', type=float, default=FLOAT32_TOLERANCE,
+                        help="float32与原值的最大误差，超过时该tag的数值列自动保留float64")
+    parser.add_argument('--sparse', action='store_true', help="同时生成只记录变化的变化存储(sparse_YYYYMM.parquet)，在月度文件之外额外占用磁盘")
+    parser.add_argument('--deadband-file', help="变化存储的死区设置，JSON格式 {tag: 死区}；查看器读取这些tag时与原始值最多相差死区")
+    parser.add_argument('--workers', type=int, default=None, help="解析用的进程数，默认等于CPU核数")
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / (1024 * 1024),
+                        help="每个任务块的raw文件总大小上限(MB)")
+    parser.add_argument('--prefix-store', action='store_true',
+                        help="同时生成按tag前缀分区的文件(by_prefix/data_<前缀>_YYYYMM.parquet)")
+    parser.add_argument('--storage-report', action='store_true',
+                        help="不入库，比较已有月度文件与旧格式(float64/int64)的大小和读取时间")
+    args = parser.parse_args()
+    
     logging.basicConfig(level=logging.INFO)
-    fetch_data()
\ No newline at end of file
+    deadbands = None
+    if args.sparse or args.deadband_file:
+        deadbands = {}
+        if args.deadband_file:
+            with open(args.deadband_file, 'r', encoding='utf-8') as f:
+                deadbands = {tag: float(value) for tag, value in json.load(f).items()}
+    
+    if args.storage_report:
+        print_storage_report('.')
+    else:
+        fetch_data(incremental=not args.full, trust_folder_mtime=args.trust_folder_mtime,
+                   merge_memory_budget=args.merge_memory_mb * 1024 * 1024,
+                   value_type=args.value_type,
+                   float64_tags=[tag for tag in args.float64_tags.split(',') if tag],
+                   deadbands=deadbands, prefix_store=args.prefix_store,
+                   workers=args.workers, chunk_bytes=int(args.chunk_mb * 1024 * 1024),
+                   float32_tolerance=args.float32_tolerance)
\ No newline at end of file
@@ -0,0 +1,38 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from data_viewer_ver13 import ChunkCache, DataViewer
+
+
+def test_query_cursor_uses_step_value_in_effect():
+    seconds = 10**9
+    index_ns = np.array([0, 3600, 7200], dtype=np.int64) * seconds
+    values = np.array([1.0, np.nan, 3.0])
+    viewer = SimpleNamespace(cursor_series=[('ax', 'line', index_ns, values, 9000 * seconds)],
+                             cursor_tolerance_ns=20 * seconds)
+
+    assert DataViewer.query_cursor(viewer, 1800 * seconds) == [('ax', 'line', 1800 * seconds, 1.0)]
+    assert DataViewer.query_cursor(viewer, 5000 * seconds) == []
+    assert DataViewer.query_cursor(viewer, 8000 * seconds) == [('ax', 'line', 8000 * seconds, 3.0)]
+    assert DataViewer.query_cursor(viewer, 9500 * seconds) == []
+
+
+def test_chunk_cache_keeps_pinned_chunks_until_unpinned():
+    cache = ChunkCache(budget_bytes=100)
+    cache.put('plot', np.zeros(10))
+    cache.pin('plot-request', ['plot'])
+    cache.put('ranges', np.zeros(10))
+    cache.trim(protected=['ranges'])
+    assert 'plot' in cache and 'ranges' in cache
+
+    cache.trim()
+    assert 'plot' in cache and 'ranges' not in cache
+
+    cache.unpin('plot-request')
+    cache.put('ranges', np.zeros(10))
+    cache.trim(protected=['ranges'])
+    assert 'plot' not in cache and 'ranges' in cache
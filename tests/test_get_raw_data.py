@@ -0,0 +1,119 @@
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmark_ingest import generate_raw_files
+from get_raw_data_ver3 import (RUN_REPORT_FILE, IngestMetrics, fetch_data, get_file_month,
+                               parse_raw_file_bulk)
+
+
+def test_get_file_month_without_timestamp():
+    assert get_file_month('SNAP_20240301120000.raw') == '202403'
+    assert get_file_month('SNAPSHOT.raw') is None
+    assert get_file_month('SNAP_bad.raw') is None
+
+
+def test_fetch_data_skips_bad_filename(tmp_path, monkeypatch):
+    folder = tmp_path / 'raw' / '20240301'
+    generate_raw_files(str(folder), 3, num_tags=8)
+    (folder / 'SNAPSHOT.raw').write_text((folder / os.listdir(folder)[0]).read_text())
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'raw'
+    assert fetch_data(str(root), workers=1)
+    with open(root / RUN_REPORT_FILE, encoding='utf-8') as f:
+        report = json.load(f)
+    assert report['errors']['by_type'] == {'bad_filename': 1}
+    assert (root / 'data_matrix_202403.parquet').exists()
+
+
+def test_parse_raw_file_bulk_rejects_offsetting_bad_lines(tmp_path):
+    raw_file = tmp_path / 'SNAP_20240301120000.raw'
+    raw_file.write_text('RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nDx\n'
+                        '1 TAG-A 1\n'
+                        '2 TAG-B 0 0 extra\n'
+                        'Ax\n'
+                        '3 TAG-C 2.5 0\n')
+    metrics = IngestMetrics()
+
+    timestamp, tags, values, qualities = parse_raw_file_bulk(str(raw_file), metrics)
+    assert tags == ['TAG-B', 'TAG-C']
+    assert values.tolist() == [0.0, 2.5]
+    assert qualities.tolist() == [0, 0]
+    assert dict(metrics.by_type) == {'short_line': 1}
+
+
+def test_fetch_data_keeps_float64_for_values_float32_cannot_hold(tmp_path, monkeypatch):
+    folder = tmp_path / 'raw' / '20240301'
+    folder.mkdir(parents=True)
+    for k, value in enumerate(['123456789.125', '123456790.5']):
+        (folder / f'SNAP_2024030112000{k}.raw').write_text(
+            'RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nAx\n'
+            f'1 TOTAL-001 {value} 0\n'
+            f'2 TEMP-002 {20.125 + k} 0\n')
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'raw'
+    assert fetch_data(str(root), workers=1)
+    table = pq.read_table(root / 'data_matrix_202403.parquet')
+    schema = table.schema
+    assert schema.field("('TOTAL-001', 'value')").type == pa.float64()
+    assert schema.field("('TEMP-002', 'value')").type == pa.float32()
+    assert table.column("('TOTAL-001', 'value')").to_pylist() == [123456789.125, 123456790.5]
+
+
+def test_rollup_envelope_skips_bad_quality_samples(tmp_path, monkeypatch):
+    folder = tmp_path / 'raw' / '20240301'
+    folder.mkdir(parents=True)
+    for k, (value, quality) in enumerate([(1.0, 0), (9999.0, 192), (2.0, 0)]):
+        (folder / f'SNAP_2024030112000{k}.raw').write_text(
+            'RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nAx\n'
+            f'1 TEMP-001 {value} {quality}\n')
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'raw'
+    assert fetch_data(str(root), workers=1)
+    rollup = pq.read_table(root / 'rollup_1min_202403.parquet').to_pandas()['TEMP-001'].iloc[0]
+    assert (rollup['min'], rollup['max'], rollup['mean']) == (1.0, 2.0, 1.5)
+    assert (rollup['count'], rollup['bad'], rollup['last']) == (2, 1, 2.0)
+    stats = pq.read_table(root / 'stats_202403.parquet').to_pandas().set_index('tag').loc['TEMP-001']
+    assert (stats['min'], stats['max'], stats['p99'], stats['count'], stats['bad']) == (1.0, 2.0, 1.99, 2, 1)
+
+
+def test_incremental_picks_up_file_rewritten_in_place(tmp_path, monkeypatch):
+    folder = tmp_path / 'raw' / '20240301'
+    folder.mkdir(parents=True)
+    raw_file = folder / 'SNAP_20240301120000.raw'
+    raw_file.write_text('RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nAx\n1 TEMP-001 1.5 0\n')
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'raw'
+    assert fetch_data(str(root), workers=1)
+    folder_mtime = os.stat(folder).st_mtime_ns
+    raw_file.write_text('RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nAx\n1 TEMP-001 2.5 0\n')
+    stat = os.stat(raw_file)
+    os.utime(raw_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    os.utime(folder, ns=(folder_mtime, folder_mtime))
+
+    assert fetch_data(str(root), workers=1)
+    table = pq.read_table(root / 'data_matrix_202403.parquet')
+    assert table.column("('TEMP-001', 'value')").to_pylist() == [2.5]
+
+
+def test_bad_named_files_are_reported_and_recorded(tmp_path, monkeypatch):
+    folder = tmp_path / 'raw' / '20240301'
+    folder.mkdir(parents=True)
+    (folder / 'SNAPSHOT.raw').write_text('RAW SNAPSHOT\n2024-03-01 12:00:00\nNO TAG VALUE QUALITY\nAx\n1 TEMP-001 1.5 0\n')
+    monkeypatch.chdir(tmp_path)
+
+    root = tmp_path / 'raw'
+    assert not fetch_data(str(root), workers=1)
+    assert not (tmp_path / 'temp_parquet').exists()
+    report = json.loads((root / RUN_REPORT_FILE).read_text(encoding='utf-8'))
+    assert report['errors']['by_type'] == {'bad_filename': 1}
+    # 文件已记入清单，下次运行不再重复检查
+    assert fetch_data(str(root), workers=1)
+    report = json.loads((root / RUN_REPORT_FILE).read_text(encoding='utf-8'))
+    assert report['files'] == 0